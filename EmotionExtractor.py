@@ -1,6 +1,25 @@
+import io
+import os
 import json
+import queue
+import logging
+import asyncio
+import hashlib
+import pathlib
+import threading
+import weakref
+import functools
+import contextlib
+from typing import Protocol
+from concurrent.futures import ThreadPoolExecutor
 
-from ibm_watson import NaturalLanguageUnderstandingV1, SpeechToTextV1
+import orjson
+import numpy as np
+import requests
+from pydub import AudioSegment
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from ibm_watson import NaturalLanguageUnderstandingV1, SpeechToTextV1, ApiException
+from ibm_watson.websocket import RecognizeCallback, AudioSource
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 from ibm_watson.natural_language_understanding_v1 \
     import Features, ClassificationsOptions
@@ -8,6 +27,370 @@ from ibm_watson.natural_language_understanding_v1 \
 import config
 # from WaveProcessor import WaveProcessor
 
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=128)
+def read_cache(cache_file):
+    """
+    Returns the contents of a given cache file, keeping the recently read files in memory.
+
+    Args:
+        cache_file (pathlib.Path): The path to the JSON cache file.
+
+    Returns:
+        dict: The cached data.
+
+    Raises:
+        FileNotFoundError: If nothing has been cached under the given path yet.
+    """
+
+    return json.loads(cache_file.read_text())
+
+def write_cache(cache_file, data):
+    """
+    Atomically writes the given data to a cache file.
+
+    Args:
+        cache_file (pathlib.Path): The path to the JSON cache file.
+        data (dict): The data to cache.
+    """
+
+    # Write to a temporary file first so that a concurrent reader never sees a partial file
+    tmp_file = cache_file.with_name(cache_file.name + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp')
+    tmp_file.write_text(json.dumps(data))
+    os.replace(tmp_file, cache_file)
+
+def speech_source(audio):
+    """
+    Returns the arguments identifying a given audio file, files on disk are identified in the decoding caches by their path and version.
+
+    Args:
+        audio: A string representing the path to the audio file, or the encoded audio file as a bytes object or a file-like object.
+
+    Returns:
+        tuple: The path, the modification time in nanoseconds and the size of the file, or the bytes of the file followed by None twice.
+    """
+
+    # The modification time and the size identify the version of the file in the cache
+    if isinstance(audio, (str, os.PathLike)):
+        stat = os.stat(audio)
+        return os.fspath(audio), stat.st_mtime_ns, stat.st_size
+
+    # The contents identify an in-memory file, read the whole buffer regardless of its position
+    if not isinstance(audio, bytes):
+        audio.seek(0)
+        audio = audio.read()
+
+    return audio, None, None
+
+def decode_speech(source):
+    """
+    Returns a given audio file decoded and resampled to 16 kHz mono.
+
+    Args:
+        source (str or bytes): A string representing the path to the audio file, or the encoded audio file.
+
+    Returns:
+        AudioSegment: The decoded audio.
+    """
+
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    # Speech recognition does not need more than 16 kHz mono
+    return AudioSegment.from_file(source).set_frame_rate(16000).set_channels(1)
+
+def export_segments(audio, seconds):
+    """
+    Returns the segments of a given decoded audio transcoded to Ogg Opus.
+
+    Args:
+        audio (AudioSegment): The decoded audio.
+        seconds (int): The length of each segment in seconds.
+
+    Returns:
+        tuple: A tuple of bytes objects, each representing one Ogg Opus segment of the audio.
+    """
+
+    segment_ms = seconds*1000
+
+    segments = []
+    for start in range(0, len(audio), segment_ms):
+        buffer = io.BytesIO()
+        audio[start:start+segment_ms].export(buffer, format='ogg', codec='libopus', bitrate='24k')
+        segments.append(buffer.getvalue())
+
+    return tuple(segments)
+
+@functools.lru_cache(maxsize=2)
+def load_speech(path, mtime, size):
+    """
+    Returns a given audio file on disk decoded and resampled to 16 kHz mono, keeping the recently decoded files in memory.
+
+    Args:
+        path (str): A string representing the path to the audio file.
+        mtime (int): The modification time of the audio file in nanoseconds.
+        size (int): The size of the audio file in bytes.
+
+    Returns:
+        AudioSegment: The decoded audio.
+    """
+
+    return decode_speech(path)
+
+@functools.lru_cache(maxsize=8)
+def transcode_segments(path, mtime, size, seconds):
+    """
+    Returns the segments of a given audio file on disk transcoded to 16 kHz mono Ogg Opus, keeping the recently transcoded files in memory.
+
+    Args:
+        path (str): A string representing the path to the audio file.
+        mtime (int): The modification time of the audio file in nanoseconds.
+        size (int): The size of the audio file in bytes.
+        seconds (int): The length of each segment in seconds.
+
+    Returns:
+        tuple: A tuple of bytes objects, each representing one Ogg Opus segment of the audio file.
+    """
+
+    return export_segments(load_speech(path, mtime, size), seconds)
+
+def speech(audio):
+    """
+    Returns a given audio file decoded and resampled to 16 kHz mono, only files on disk are kept in the decoding caches.
+
+    An in-memory upload would otherwise become a cache key itself and stay in memory for the life of the process, while it is never uploaded again.
+
+    Args:
+        audio: A string representing the path to the audio file, the encoded audio file as a bytes object or a file-like object, or the already decoded AudioSegment.
+
+    Returns:
+        AudioSegment: The decoded audio.
+    """
+
+    if isinstance(audio, AudioSegment):
+        return audio
+
+    source, mtime, size = speech_source(audio)
+    if mtime is None:
+        return decode_speech(source)
+
+    return load_speech(source, mtime, size)
+
+def websocket_error_code(error):
+    """
+    Returns the HTTP status code matching an error reported through the Speech-to-Text WebSocket interface.
+
+    The service reports its errors as plain messages, so a session timeout is mapped to 408 and any other message to 400 so that it is not retried. Errors raised by the connection itself keep their status code or count as a server error.
+
+    Args:
+        error: The exception or the error message reported by the service.
+
+    Returns:
+        int: The HTTP status code of the error.
+    """
+
+    if isinstance(error, str):
+        message = error.lower()
+        return 408 if 'timed out' in message or 'timeout' in message else 400
+
+    return getattr(error, 'status_code', 500)
+
+def is_transient_error(exception):
+    """
+    Returns whether a given exception is a transient IBM Cloud error worth retrying.
+
+    Args:
+        exception (Exception): The exception raised by the call.
+
+    Returns:
+        bool: True if the call was rate-limited, timed out or hit a temporary server error.
+    """
+
+    return isinstance(exception, ApiException) and exception.code in (408, 429, 500, 502, 503, 504)
+
+def wait_rate_limited(retry_state):
+    """
+    Returns the additional time to wait before retrying a call rejected for exceeding the rate limits.
+
+    Args:
+        retry_state (tenacity.RetryCallState): The state of the retried call.
+
+    Returns:
+        float: The additional time to wait in seconds.
+    """
+
+    exception = retry_state.outcome.exception()
+
+    return config.API_RATE_LIMIT_WAIT if isinstance(exception, ApiException) and exception.code == 429 else 0
+
+retry_transient_errors = retry(
+    stop=stop_after_attempt(config.API_RETRIES),
+    wait=wait_exponential_jitter(1, 10) + wait_rate_limited,
+    retry=retry_if_exception(is_transient_error),
+    reraise=True,
+)
+
+def parse_json_with_orjson(response, *args, **kwargs):
+    """
+    A requests response hook making the response parse its JSON body with orjson instead of the standard library.
+
+    Args:
+        response (requests.Response): The response received from the service.
+    """
+
+    response.json = lambda **_: orjson.loads(response.content)
+
+@functools.lru_cache(maxsize=1)
+def http_session():
+    """
+    Returns the HTTP session shared by the Watson clients of the process, so that the connections to IBM Cloud stay open across the uploads instead of being handshaken again for every new extractor.
+
+    Returns:
+        requests.Session: The session with a pool of keep-alive connections parsing the JSON responses with orjson.
+    """
+
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+    )
+    session = requests.Session()
+    session.headers['Connection'] = 'keep-alive'
+    session.mount('https://', adapter)
+    session.hooks['response'].append(parse_json_with_orjson)
+
+    return session
+
+class STTBackend(Protocol):
+    """
+    An interface of a speech-to-text engine used instead of the IBM Watson Speech-to-Text service.
+    """
+    def transcribe(self, audio):
+        """
+        Returns the transcribed text from a given audio file.
+
+        Args:
+            audio: A string representing the path to the audio file, or a file-like object of the encoded audio file.
+
+        Returns:
+            str: A string representing the transcribed text from the audio file.
+        """
+        ...
+
+class FasterWhisperBackend():
+    """
+    A speech-to-text engine transcribing the audio locally with a faster-whisper model, avoiding the network round-trip to IBM Cloud.
+
+    Attributes:
+        model (WhisperModel): The faster-whisper model.
+    """
+    def __init__(self, model=config.WHISPER_MODEL, device=config.WHISPER_DEVICE, compute_type=config.WHISPER_COMPUTE_TYPE):
+        """
+        Initializes FasterWhisperBackend class by loading the given model.
+
+        Args:
+            model (str): The size or the path of the Whisper model.
+            device (str): The device running the model, such as 'cuda' or 'cpu'.
+            compute_type (str): The quantization of the model weights.
+        """
+
+        # faster-whisper is only needed when this backend is selected
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(model, device=device, compute_type=compute_type)
+
+    def transcribe(self, audio):
+        """
+        Returns the transcribed text from a given audio file.
+
+        Args:
+            audio: A string representing the path to the audio file, or a file-like object of the encoded audio file.
+
+        Returns:
+            str: A string representing the transcribed text from the audio file.
+        """
+
+        segments, _ = self.model.transcribe(audio, beam_size=1, vad_filter=True)
+
+        return ''.join(segment.text for segment in segments).strip()
+
+@functools.lru_cache(maxsize=1)
+def whisper_backend(model, device, compute_type):
+    """
+    Returns the faster-whisper engine for the given model, loading it once per process because a new extractor is created for every upload.
+
+    Args:
+        model (str): The size or the path of the Whisper model.
+        device (str): The device running the model, such as 'cuda' or 'cpu'.
+        compute_type (str): The quantization of the model weights.
+
+    Returns:
+        FasterWhisperBackend: The loaded engine.
+    """
+
+    return FasterWhisperBackend(model, device, compute_type)
+
+class TranscriptCallback(RecognizeCallback):
+    """
+    A callback collecting the transcripts streamed back by the Speech-to-Text WebSocket interface.
+
+    Attributes:
+        transcripts (dict): The transcripts of the final results, keyed by their result index.
+        analyses (list): A list of (length, future) tuples for the transcripts submitted to the analyze function.
+        analyze (callable): A function submitting a transcript for analysis and returning its future, or None.
+        error: The error reported by the service during the recognition, or None.
+    """
+    def __init__(self, analyze=None):
+        """
+        Initializes TranscriptCallback class with no transcripts and no error.
+
+        Args:
+            analyze (callable, optional): A function submitting each final transcript long enough for analysis and returning its future. Defaults to None.
+        """
+
+        RecognizeCallback.__init__(self)
+        self.transcripts = {}
+        self.analyses = []
+        self.analyze = analyze
+        self.error = None
+
+    def on_data(self, data):
+        """
+        Stores the transcripts of the final results received from the service and submits them for analysis.
+
+        Args:
+            data (dict): The recognition results sent by the service.
+        """
+
+        for i, result in enumerate(data['results'], data.get('result_index', 0)):
+            if result.get('final'):
+                transcript = result['alternatives'][0]['transcript']
+                self.transcripts[i] = transcript
+
+                # Analyse the finished part of the speech while the rest is still being transcribed
+                if self.analyze and len(transcript) >= config.NLU_MIN_CHARS:
+                    self.analyses.append((len(transcript), self.analyze(transcript)))
+
+    def on_error(self, error):
+        """
+        Stores the error reported by the service.
+
+        Args:
+            error: The exception or the error message reported by the service.
+        """
+
+        self.error = error
+
+    def get_text(self):
+        """
+        Returns the transcribed text assembled from the final results in order.
+
+        Returns:
+            str: A string representing the transcribed text.
+        """
+
+        return ''.join(self.transcripts[i] for i in sorted(self.transcripts))
+
 class EmotionExtractor():
     """
     A class to extract emotions from speech using IBM Watson Speech-to-Text and Natural Language Understanding services.
@@ -15,64 +398,374 @@ class EmotionExtractor():
     Attributes:
         nlu (NaturalLanguageUnderstandingV1): Instance of the Natural Language Understanding service.
         stt (SpeechToTextV1): Instance of the Speech-to-Text service.
+        stt_pool (queue.Queue): A pool of Speech-to-Text service instances, one for each concurrent recognition.
+        stt_backend (STTBackend): The local speech-to-text engine selected by config.STT_BACKEND, or None for IBM Watson.
         nlu_model_id (str): The ID of the Natural Language Understanding model.
         stt_model_id (str): The ID of the Speech-to-Text model.
+        nlu_features (Features): The features requested from the Natural Language Understanding service.
+        stt_options (dict): The recognition parameters passed to the Speech-to-Text service.
+        session (requests.Session): The HTTP session of the process keeping the connections to IBM Cloud alive between the calls.
         text (str): The most recent transcribed text from the audio file.
+        partial_analyses (tuple): The most recent transcribed text and the (length, future) tuples of the analyses of its parts.
+        nlu_executor (ThreadPoolExecutor): The executor analysing the parts of the text during the transcription.
+        async_limits (weakref.WeakKeyDictionary): The semaphores limiting the number of concurrent asynchronous calls, one for each event loop.
+        nlu_cache_dir (pathlib.Path): The directory storing the emotions of the previously analysed texts.
+        stt_cache_dir (pathlib.Path): The directory storing the transcripts of the previously seen audio files.
     """
-    def __init__(self):
+    def __init__(self, prewarm=False):
+        """
+        Initializes EmotionExtractor class with the model IDs and the shared HTTP session. The clients of the Speech-to-Text and Natural Language Understanding services are created on their first use.
+
+        Args:
+            prewarm (bool, optional): If True, creates both clients and fetches their IAM tokens concurrently in the background. Defaults to False.
+        """
+
+        self.nlu_model_id = config.NLU_MODEL_ID
+        self.nlu_features = Features(classifications=ClassificationsOptions(model=self.nlu_model_id))
+
+        self.nlu_cache_dir = pathlib.Path(config.NLU_CACHE_DIR)
+        self.nlu_cache_dir.mkdir(exist_ok=True)
+
+        self.stt_model_id = config.STT_MODEL_ID
+        self.stt_options = dict(
+            content_type='audio/ogg;codecs=opus',
+            model=self.stt_model_id,
+            inactivity_timeout=360,
+        )
+
+        self.stt_cache_dir = pathlib.Path(config.STT_CACHE_DIR)
+        self.stt_cache_dir.mkdir(exist_ok=True)
+
+        # Share one pool of keep-alive connections between the services and the extractors
+        self.session = http_session()
+
+        self.text = ""
+        self.partial_analyses = ("", [])
+        self.nlu_executor = ThreadPoolExecutor(max_workers=config.NLU_MAX_WORKERS)
+
+        # Limit the number of concurrent asynchronous calls to respect the rate limits, the semaphore is created in the running event loop
+        self.async_limits = weakref.WeakKeyDictionary()
+
+        # Fetch the IAM tokens before the first calls need them
+        if prewarm:
+            self.nlu_executor.submit(lambda: self.nlu.authenticator.token_manager.get_token())
+            self.nlu_executor.submit(lambda: self.stt.authenticator.token_manager.get_token())
+
+    @functools.cached_property
+    def nlu(self):
         """
-        Initializes EmotionExtractor class with the IBM Cloud authentication details for the Speech-to-Text and Natural Language Understanding services.
+        Returns the Natural Language Understanding service instance, authenticating it with IBM Cloud on the first use.
+
+        Returns:
+            NaturalLanguageUnderstandingV1: Instance of the Natural Language Understanding service.
         """
 
         # Authenticate Natural Language Understanding model with IBM Cloud
-        self.nlu = NaturalLanguageUnderstandingV1(
+        nlu = NaturalLanguageUnderstandingV1(
             version='2022-04-07',
             authenticator=IAMAuthenticator(config.NLU_API_KEY)
         )
 
-        self.nlu.set_service_url(config.NLU_URL)
-        self.nlu_model_id = config.NLU_MODEL_ID
+        nlu.set_service_url(config.NLU_URL)
+        nlu.set_http_client(self.session)
+
+        return nlu
+
+    @functools.cached_property
+    def stt(self):
+        """
+        Returns the Speech-to-Text service instance, authenticating it with IBM Cloud on the first use.
+
+        Returns:
+            SpeechToTextV1: Instance of the Speech-to-Text service.
+        """
 
         # Authenticate Speech-to-Text model with IBM Cloud
-        self.stt = SpeechToTextV1(
+        stt = SpeechToTextV1(
             authenticator=IAMAuthenticator(config.STT_API_KEY)
         )
 
-        self.stt.set_service_url(config.STT_URL)
-        self.stt_model_id = config.STT_MODEL_ID
+        stt.set_service_url(config.STT_URL)
+        stt.set_http_client(self.session)
 
-        self.text = ""
+        return stt
+
+    @functools.cached_property
+    def stt_pool(self):
+        """
+        Returns the pool of Speech-to-Text service instances, creating it on the first use.
+
+        Returns:
+            queue.Queue: A pool of Speech-to-Text service instances, one for each concurrent recognition.
+        """
+
+        # Create a client for each concurrent recognition, sharing the IAM token and the connections
+        stt_pool = queue.Queue()
+        stt_pool.put(self.stt)
+        for _ in range(config.STT_MAX_WORKERS-1):
+            stt = SpeechToTextV1(authenticator=self.stt.authenticator)
+            stt.set_service_url(config.STT_URL)
+            stt.set_http_client(self.session)
+            stt_pool.put(stt)
+
+        return stt_pool
+
+    @functools.cached_property
+    def stt_backend(self):
+        """
+        Returns the local speech-to-text engine selected in the configuration, shared by all the extractors of the process.
+
+        Returns:
+            STTBackend: The local speech-to-text engine, or None if IBM Watson Speech-to-Text is used.
+        """
+
+        if config.STT_BACKEND == 'faster-whisper':
+            return whisper_backend(config.WHISPER_MODEL, config.WHISPER_DEVICE, config.WHISPER_COMPUTE_TYPE)
+
+        return None
+
+    def segment_audio(self, audio, seconds=config.STT_SEGMENT_SECONDS):
+        """
+        Splits a given audio file into Ogg Opus segments of a fixed length, transcoded to 16 kHz mono to reduce the upload size.
+
+        Args:
+            audio: A string representing the path to the audio file, the encoded audio file as a bytes object or a file-like object, or the already decoded AudioSegment.
+            seconds (int): The length of each segment in seconds.
+
+        Returns:
+            list: A list of bytes objects, each representing one Ogg Opus segment of the audio file.
+        """
+
+        if isinstance(audio, (str, os.PathLike)):
+            return list(transcode_segments(*speech_source(audio), seconds))
+
+        return list(export_segments(speech(audio), seconds))
+
+    def is_silent(self, audio, frame_ms=100, threshold=config.VAD_RMS_THRESHOLD):
+        """
+        Returns whether a given audio file contains no frame loud enough to be speech.
+
+        Args:
+            audio: A string representing the path to the audio file, the encoded audio file as a bytes object or a file-like object, or the already decoded AudioSegment.
+            frame_ms (int): The length of each frame in milliseconds.
+            threshold (float): The RMS level, as a fraction of the full scale, below which a frame is silent.
+
+        Returns:
+            bool: True if every frame of the audio file is silent.
+        """
+
+        audio = speech(audio)
+
+        # Scale the samples to the range from -1 to 1
+        samples = np.array(audio.get_array_of_samples(), dtype=np.float32) / (1 << (8*audio.sample_width - 1))
+
+        frame_size = audio.frame_rate*frame_ms//1000
+        frames_num = len(samples)//frame_size
+        if frames_num == 0:
+            return True
+
+        frames = samples[:frames_num*frame_size].reshape(frames_num, frame_size)
+        rms = np.sqrt(np.mean(frames**2, axis=1))
+
+        return rms.max() < threshold
+
+    def _audio_buffer(self, chunk, size=config.STT_STREAM_CHUNK_BYTES):
+        """
+        Returns a queue of the pieces of a given audio segment for streaming it to the Speech-to-Text service.
+
+        The SDK sends one queued piece at a time while it reads a file 1 KB at a time, pausing briefly after each send in both cases, so bigger pieces let the upload run at the speed of the network.
+
+        Args:
+            chunk (bytes): A bytes object representing an audio segment.
+            size (int): The size of each piece in bytes.
+
+        Returns:
+            queue.Queue: A queue of bytes objects, each representing one piece of the audio segment.
+        """
+
+        buffer = queue.Queue()
+        for start in range(0, len(chunk), size):
+            buffer.put(chunk[start:start+size])
+
+        return buffer
+
+    @contextlib.contextmanager
+    def _borrow_stt(self):
+        """
+        Lends a Speech-to-Text service instance from the pool, waiting for one to be returned if all are in use.
+
+        Yields:
+            SpeechToTextV1: An instance of the Speech-to-Text service.
+        """
+
+        stt = self.stt_pool.get()
+        try:
+            yield stt
+        finally:
+            self.stt_pool.put_nowait(stt)
+
+    @retry_transient_errors
+    def _do_recognize(self, chunk, analyses):
+        """
+        Returns the transcribed text from a given audio segment, retrying on transient errors.
+
+        Args:
+            chunk (bytes): A bytes object representing an Ogg Opus audio segment.
+            analyses (list): A list extended with the (length, future) tuples of the analyses of the transcribed parts.
+
+        Returns:
+            str: A string representing the transcribed text from the audio segment.
+        """
+
+        callback = TranscriptCallback(
+            analyze=lambda transcript: self.nlu_executor.submit(self.get_nlu_response, transcript)
+        )
+
+        # Transcribe the speech, streaming the audio to the service as it is read
+        with self._borrow_stt() as stt:
+            stt.recognize_using_websocket(
+                audio=AudioSource(self._audio_buffer(chunk), is_buffer=True),
+                recognize_callback=callback,
+                **self.stt_options,
+            )
+
+        if callback.error is not None:
+            raise ApiException(websocket_error_code(callback.error), message=str(callback.error))
+
+        analyses.extend(callback.analyses)
+        return callback.get_text()
+
+    def _recognize_chunk(self, chunk, analyses):
+        """
+        Returns the transcribed text from a given audio segment, splitting it in half if the service keeps timing out.
+
+        Args:
+            chunk (bytes): A bytes object representing an Ogg Opus audio segment.
+            analyses (list): A list extended with the (length, future) tuples of the analyses of the transcribed parts.
+
+        Returns:
+            str: A string representing the transcribed text from the audio segment.
+        """
 
-    def get_stt_response(self, path):
+        try:
+            return self._do_recognize(chunk, analyses)
+        except ApiException as e:
+            if e.code not in (408, 504) or len(chunk) < config.STT_MIN_SPLIT_BYTES:
+                raise
+
+        # Transcribe the halves separately so that the rest of the transcript is not lost
+        audio = AudioSegment.from_file(io.BytesIO(chunk), format='ogg')
+        text = ""
+        for half in (audio[:len(audio)//2], audio[len(audio)//2:]):
+            buffer = io.BytesIO()
+            half.export(buffer, format='ogg', codec='libopus', bitrate='24k')
+            text += self._recognize_chunk(buffer.getvalue(), analyses)
+
+        return text
+
+    def get_stt_response(self, audio):
         """
         Returns the transcribed text from a given audio file.
 
         Args:
-            path (str): A string representing the path to the audio file.
+            audio: A string representing the path to the audio file, or the encoded audio file as a bytes object or a file-like object.
 
         Returns:
             str: A string representing the transcribed text from the audio file.
         """
 
-        # Transcribe the speech
-        with open(path, 'rb') as proc_audio_file:
+        # Look up the transcript of an identical recording
+        model_id = config.WHISPER_MODEL if config.STT_BACKEND == 'faster-whisper' else self.stt_model_id
+        digest = hashlib.blake2b((config.STT_BACKEND + '\n' + model_id).encode(), digest_size=16)
+        source, mtime, size = speech_source(audio)
+        if mtime is None:
+            # Pass the bytes on instead of reading the buffer again
+            audio = source
+            digest.update(source)
+        else:
+            with open(source, 'rb') as proc_audio_file:
+                digest.update(proc_audio_file.read())
+        cache_file = self.stt_cache_dir / (digest.hexdigest() + '.json')
 
-            stt_response = self.stt.recognize(
-                audio=proc_audio_file,
-                content_type='audio/mp3',
-                model=self.stt_model_id,
-                inactivity_timeout=360,
-            ).get_result()
+        try:
+            self.text = read_cache(cache_file)['text']
+            self.partial_analyses = (self.text, [])
+            return self.text
+        except FileNotFoundError:
+            pass
 
-        text = ""
-        for result in stt_response['results']:
-            text += result['alternatives'][0]['transcript']
+        analyses = []
 
-        print(text)
+        # An in-memory upload is decoded once for the silence check and the segmentation, it is kept out of the decoding caches
+        decoded = audio
+        if mtime is None and (config.ENABLE_VAD_GATE or self.stt_backend is None):
+            decoded = decode_speech(source)
+
+        # Skip the transcription of recordings without any speech
+        if config.ENABLE_VAD_GATE and self.is_silent(decoded):
+            text = ""
+        elif self.stt_backend is not None:
+            text = self.stt_backend.transcribe(io.BytesIO(audio) if isinstance(audio, bytes) else audio)
+        else:
+            # Transcribe the segments concurrently, keeping their order
+            segments = self.segment_audio(decoded)
+            with ThreadPoolExecutor(max_workers=config.STT_MAX_WORKERS) as executor:
+                transcripts = list(executor.map(functools.partial(self._recognize_chunk, analyses=analyses), segments))
+
+            text = ''.join(transcripts)
+
+        write_cache(cache_file, {'text': text})
+
+        logger.debug('stt transcript (%d chars)', len(text))
 
         self.text = text
+        self.partial_analyses = (text, analyses)
         return text
 
+    @retry_transient_errors
+    def _analyze(self, text):
+        """
+        Returns the emotions of a given text as determined by the NLU model, retrying on transient errors.
+
+        Args:
+            text (str): A string representing the text to be analyzed.
+
+        Returns:
+            list: A list of emotions and their confidence levels.
+        """
+
+        # Analyse the tone to get the emotions
+        response = self.nlu.analyze(
+            text=text,
+            features=self.nlu_features,
+        ).get_result()
+
+        return response['classifications']
+
+    def merge_classifications(self, analyses):
+        """
+        Merges the emotions of several parts of a text, weighting each part by its length.
+
+        Args:
+            analyses (list): A list of (length, future) tuples, each future resolving to the emotions of one part of the text.
+
+        Returns:
+            list: A list of emotions and their confidence levels, sorted from the most confident.
+        """
+
+        totals = {}
+        total_length = 0
+
+        for length, future in analyses:
+            for el in future.result():
+                totals[el['class_name']] = totals.get(el['class_name'], 0.0) + el['confidence']*length
+            total_length += length
+
+        classifications = [{'class_name': class_name, 'confidence': total/total_length} for class_name, total in totals.items()]
+        classifications.sort(key=lambda el: el['confidence'], reverse=True)
+
+        return classifications
+
     def get_nlu_response(self, text=None):
         """
         Analyzes the tone of a given text and returns the emotions.
@@ -86,12 +779,102 @@ class EmotionExtractor():
 
         if text is None:
             text = self.text
-        
-        # Analyse the tone to get the emotions
-        response = self.nlu.analyze(
-            text=text,
-            features=Features(classifications=ClassificationsOptions(model=config.NLU_MODEL_ID)),
-            
-        ).get_result()
 
-        return response['classifications']
\ No newline at end of file
+        # Look up the emotions of an identical text
+        digest = hashlib.sha1((self.nlu_model_id + '\n' + text).encode()).hexdigest()
+        cache_file = self.nlu_cache_dir / (digest + '.json')
+
+        try:
+            return read_cache(cache_file)['classifications']
+        except FileNotFoundError:
+            pass
+
+        # Reuse the analyses of the text's parts submitted during the transcription only if they cover all of it, a short part is not analysed on its own
+        classifications = None
+        partial_text, analyses = self.partial_analyses
+        if analyses and text == partial_text and sum(length for length, _ in analyses) == len(text):
+            try:
+                classifications = self.merge_classifications(analyses)
+            except (ApiException, requests.RequestException) as e:
+                logger.debug('partial analysis failed, analysing the whole text: %s', e)
+
+        if classifications is None:
+            classifications = self._analyze(text)
+
+        # The merged emotions are cached under the whole text, so a recording gives the same emotions whether its transcript was cached or not
+        write_cache(cache_file, {'classifications': classifications})
+
+        return classifications
+
+    def get_nlu_response_batch(self, texts):
+        """
+        Analyzes the tone of several texts concurrently and returns their emotions.
+
+        Args:
+            texts (list): A list of strings representing the texts to be analyzed.
+
+        Returns:
+            list: A list containing the emotions and their confidence levels for each text, in the order of the texts.
+        """
+
+        # The classifications are computed over the whole request text, so the texts cannot be joined into one request
+        return list(self.nlu_executor.map(self.get_nlu_response, texts))
+
+    def async_limit(self):
+        """
+        Returns the semaphore limiting the number of concurrent asynchronous calls in the running event loop, a semaphore bound to one loop cannot be awaited in another.
+
+        Returns:
+            asyncio.Semaphore: The semaphore of the running event loop.
+        """
+
+        loop = asyncio.get_running_loop()
+        if loop not in self.async_limits:
+            self.async_limits[loop] = asyncio.Semaphore(config.STT_MAX_WORKERS)
+
+        return self.async_limits[loop]
+
+    async def transcribe_async(self, audio):
+        """
+        Asynchronously returns the transcribed text from a given audio file.
+
+        Args:
+            audio: A string representing the path to the audio file, or the encoded audio file as a bytes object or a file-like object.
+
+        Returns:
+            str: A string representing the transcribed text from the audio file.
+        """
+
+        async with self.async_limit():
+            return await asyncio.to_thread(self.get_stt_response, audio)
+
+    async def analyze_async(self, text):
+        """
+        Asynchronously analyzes the tone of a given text and returns the emotions.
+
+        Args:
+            text (str): A string representing the text to be analyzed.
+
+        Returns:
+            list: A list of emotions and their confidence levels as determined by the NLU model.
+        """
+
+        async with self.async_limit():
+            return await asyncio.to_thread(self.get_nlu_response, text)
+
+    async def process(self, paths):
+        """
+        Asynchronously extracts the emotions from the given audio files, analysing each transcript as soon as it is ready.
+
+        Args:
+            paths (list): A list of strings representing the paths to the audio files.
+
+        Returns:
+            list: A list containing the emotions and their confidence levels for each audio file.
+        """
+
+        async def extract(path):
+            text = await self.transcribe_async(path)
+            return await self.analyze_async(text)
+
+        return await asyncio.gather(*(extract(path) for path in paths))
\ No newline at end of file
@@ -1,11 +1,245 @@
 import cadquery as cq
+import numpy as np
+import numba
+import functools
+import logging
 import math
 import random
+from OCP.Bnd import Bnd_Box
+from OCP.BRepBndLib import BRepBndLib
+from OCP.Standard import (Standard_Failure, Standard_ConstructionError, Standard_DomainError, Standard_ProgramError,
+                          Standard_NoSuchObject, Standard_NullObject, Standard_OutOfRange, Standard_RangeError,
+                          Standard_NumericError, Standard_DivideByZero)
+from OCP.StdFail import StdFail_NotDone, StdFail_Undefined, StdFail_UndefinedDerivative
+from OCP.gp import gp_VectorWithNullMagnitude
+
+logger = logging.getLogger(__name__)
 
 # Set the parameters
 p_num = 50 # Number of points to deviate the bottom base
 r = 60.0 # The model's radius
 h = 60.0 # The height of the entire model
+layer_retries = 3 # Number of attempts to build a layer before the whole top is regenerated
+
+# Errors thrown by CadQuery and the OCCT kernel when the stochastic geometry cannot be built. OCP binds every OCCT exception as a direct subclass of Exception, so each construction failure is listed, while signals and memory faults are left to surface.
+GEOMETRY_ERRORS = (
+    ValueError,
+    Standard_Failure,
+    Standard_ConstructionError,
+    Standard_DomainError,
+    Standard_ProgramError,
+    Standard_NoSuchObject,
+    Standard_NullObject,
+    Standard_OutOfRange,
+    Standard_RangeError,
+    Standard_NumericError,
+    Standard_DivideByZero,
+    StdFail_NotDone,
+    StdFail_Undefined,
+    StdFail_UndefinedDerivative,
+    gp_VectorWithNullMagnitude,
+)
+
+@functools.lru_cache(maxsize=64)
+def trig_table(polygon_p_num):
+    """
+    Returns the cosines and sines of the vertex angles of a regular polygon, cached because the same polygons are generated again on every retry.
+
+    Args:
+        polygon_p_num (int): The number of points of the regular polygon.
+
+    Returns:
+        tuple: Two read-only NumPy arrays with the cosines and the sines of the angles.
+    """
+
+    angles = np.arange(1, polygon_p_num+1)*2*np.pi/polygon_p_num
+    cos_tab, sin_tab = np.cos(angles), np.sin(angles)
+    cos_tab.flags.writeable = False
+    sin_tab.flags.writeable = False
+
+    return cos_tab, sin_tab
+
+@numba.njit(cache=True)
+def polygon_core(cos_tab, sin_tab, pol_r, deviation, symmetry, r):
+    """
+    Computes the points of a deformed regular polygon, compiled with Numba because it runs for every polygon of every retry.
+
+    Args:
+        cos_tab (np.ndarray): The cosines of the vertex angles from trig_table.
+        sin_tab (np.ndarray): The sines of the vertex angles from trig_table.
+        pol_r (float): The radius of the regular polygon.
+        deviation (np.ndarray): The deviation of each point of the polygon.
+        symmetry (bool): A boolean indicating whether the polygon is symmetrical or not.
+        r (float): The model's radius, the polygon is centred at (-r, 0).
+
+    Returns:
+        pts: An (N, 2) array with the points of the polygon.
+    """
+
+    n = cos_tab.shape[0]
+    x = np.empty(n)
+    y = np.empty(n)
+    for k in range(n):
+        x[k] = (1+deviation[k])*pol_r*cos_tab[k]-r
+        y[k] = (1+deviation[k])*pol_r*sin_tab[k]
+
+    pts = np.empty((2*n, 2))
+    m = 0
+
+    if symmetry:
+        # Keep the points until the first one below the X axis
+        first_out = n
+        for k in range(n):
+            if y[k] < -r/20:
+                first_out = k
+                break
+
+        for k in range(first_out):
+            pts[m, 0] = x[k]
+            pts[m, 1] = y[k]
+            m += 1
+
+        # Mirror the points clearly above the X axis on the other side of Y axis
+        for k in range(first_out-1, -1, -1):
+            if y[k] >= r/20:
+                pts[m, 0] = x[k]
+                pts[m, 1] = -y[k]
+                m += 1
+
+        # Close the shape with the last relevant point after the cut
+        for k in range(n-1, first_out, -1):
+            if y[k] >= -r/20:
+                pts[m, 0] = x[k]
+                pts[m, 1] = y[k]
+                m += 1
+                break
+
+    else:
+        for k in range(n):
+            pts[m, 0] = x[k]
+            pts[m, 1] = y[k]
+            m += 1
+
+    pts = pts[:m]
+
+    # Move the points if deviation affected the centre of mass
+    shift_x = -r - pts[:, 0].mean()
+    shift_y = -pts[:, 1].mean()
+    for k in range(m):
+        pts[k, 0] += shift_x
+        pts[k, 1] += shift_y
+
+    return pts
+
+@functools.lru_cache(maxsize=64)
+def spike_sketch(polygon_pts_num, circle_r):
+    """
+    Returns the sketch of the regular polygon at the base of a spiky prism, cached because the prisms repeat the same few shapes. placeSketch places a copy of it, so the cached sketch is never modified.
+
+    Args:
+        polygon_pts_num (int): The number of points of the regular polygon.
+        circle_r (float): The radius of the regular polygon, rounded so that similar prisms share the sketch.
+
+    Returns:
+        cq.Sketch: The sketch of the polygon centred at the origin.
+    """
+
+    cos_tab, sin_tab = trig_table(polygon_pts_num)
+    pts = polygon_core(cos_tab, sin_tab, float(circle_r), np.zeros(polygon_pts_num), False, r)
+    pts[:, 0] += r
+
+    return cq.Sketch().polygon(list(map(tuple, pts.tolist())), tag='face')
+
+class NearestCenterSelector(cq.selectors.NearestToPointSelector):
+    """
+    NearestToPointSelector that only computes the centres of mass of the objects whose bounding box can still contain a nearer centre.
+    """
+
+    def __init__(self, pnt, centers=None):
+        """
+        Args:
+            pnt (Tuple[float, float, float]): The point to select the nearest object to.
+            centers (Dict[int, list]): The centres of mass already computed, shared between the selectors of a model.
+        """
+
+        super().__init__(pnt)
+        self.centers = {} if centers is None else centers
+
+    def cached_center(self, obj):
+        """
+        Returns the cached centre of mass of an object, or None if it was not computed yet.
+
+        Args:
+            obj (cq.Shape): The object to look up.
+
+        Returns:
+            cq.Vector: The centre of mass of the object, or None.
+        """
+
+        # The faces that an operation does not touch are shared with the previous solid
+        for shape, center in self.centers.get(obj.hashCode(), ()):
+            if shape.IsSame(obj.wrapped):
+                return center
+
+        return None
+
+    def center(self, obj):
+        """
+        Returns the centre of mass of an object, computing it only once.
+
+        Args:
+            obj (cq.Shape): The object to look up.
+
+        Returns:
+            cq.Vector: The centre of mass of the object.
+        """
+
+        center = self.cached_center(obj)
+        if center is None:
+            center = obj.Center()
+            self.centers.setdefault(obj.hashCode(), []).append((obj.wrapped, center))
+
+        return center
+
+    def filter(self, objectList):
+        """
+        Selects the object with the centre of mass nearest to the point, like NearestToPointSelector.
+
+        Args:
+            objectList (List[cq.Shape]): The objects to select from.
+
+        Returns:
+            List[cq.Shape]: A list with the nearest object, the first one on ties.
+        """
+
+        if not objectList:
+            return super().filter(objectList)
+
+        pnt = cq.Vector(*self.pnt)
+
+        # The centre of mass lies inside the bounding box, so the distance to the box is a lower bound
+        lower = np.empty(len(objectList))
+        for i, obj in enumerate(objectList):
+            center = self.cached_center(obj)
+            if center is not None:
+                lower[i] = center.sub(pnt).Length
+                continue
+
+            box = Bnd_Box()
+            BRepBndLib.Add_s(obj.wrapped, box, True)
+            bounds = np.array(box.Get())
+            lower[i] = np.linalg.norm(np.maximum(bounds[:3]-self.pnt, 0) + np.maximum(self.pnt-bounds[3:], 0))
+
+        # Visit the objects by increasing lower bound until none of the rest can be nearer
+        best, best_dist = None, math.inf
+        for i in np.argsort(lower, kind='stable').tolist():
+            if lower[i] > best_dist:
+                break
+            dist = self.center(objectList[i]).sub(pnt).Length
+            if dist < best_dist or (dist == best_dist and i < best):
+                best, best_dist = i, dist
+
+        return [objectList[best]]
 
 class SculptureGenerator():
     """
@@ -21,12 +255,57 @@ class SculptureGenerator():
             cur_h: float, stores the current height of the sculpture
             recent_points: list, stores the previous generated points of the sculpture
             response: list, stores the emotion input as a list of dictionaries
+            rng: random.Random, the generator of the scalar random parameters
+            np_rng: np.random.Generator, the generator of the random parameter arrays
+            face_centers: dict, the centres of mass of the model faces shared by the face selectors
         """
 
         self.old_center = (0.0, 0.0)
         self.cur_h = 0.0
         self.recent_points = []
         self.response = []
+        self.rng = random.Random()
+        self.np_rng = np.random.default_rng()
+        self.face_centers = {}
+
+    def nearest(self, pnt):
+        """
+        Returns a selector of the face nearest to a point that reuses the centres computed for the previous selections.
+
+        Args:
+            pnt: tuple, the point to select the nearest face to
+
+        Returns:
+            selector: a NearestCenterSelector sharing the face_centers cache
+        """
+
+        return NearestCenterSelector(pnt, self.face_centers)
+
+    def snapshot(self):
+        """
+        Returns the modelling state that the layer functions change.
+
+        Returns:
+            state: a dictionary with the old_center, cur_h and recent_points attributes
+        """
+
+        return {
+            "old_center": self.old_center,
+            "cur_h": self.cur_h,
+            "recent_points": self.recent_points
+        }
+
+    def restore(self, state):
+        """
+        Restores the modelling state after a failed layer.
+
+        Args:
+            state: a dictionary returned by snapshot
+        """
+
+        self.old_center = state["old_center"]
+        self.cur_h = state["cur_h"]
+        self.recent_points = state["recent_points"]
 
     def gen_waveform_base(self, p_num, r, h, audio_array, rand_base=False, skip_p=None):
         """
@@ -36,36 +315,32 @@ class SculptureGenerator():
             p_num: the number of points used to create the bottom part of the sculpture
             r: the radius of the bottom part of the sculpture
             h: the height of the sculpture
-            audio_array: array of audio data
-            rand_base: boolean indicating whether to use a random array instead of the audio waveform
+            audio_array: array of audio data, or the random array replacing it
+            rand_base: boolean indicating whether audio_array is a random array instead of the audio waveform, the points to skip are then chosen randomly
             skip_p: number of points to skip in the waveform
 
         Returns:
             bot: the bottom part of the sculpture
         """
 
-        # Use a random array instead of the audio waveform if necessary
+        # Skip a random number of points of the random array
         if rand_base:
-            print("Unable to produce the base using waveform, generating with random numbers...")
-            audio_array = [round(random.uniform(-0.04, 0.04), 4) for _ in range(p_num)]
-            r = random.random()
-            if r <= (1/3):
+            logger.debug("Unable to produce the base using waveform, generating with random numbers...")
+            choice = self.rng.random()
+            if choice <= (1/3):
                 skip_p = None
-            elif r <= (2/3):
+            elif choice <= (2/3):
                 skip_p = 1
             else:
                 skip_p = 2
         
-        # Create a set of points that deviate the bottom base circle according to the waveform
-        points = []
-        for n in range(p_num):
-            deviation = audio_array[n]
-            new_point = ((1+deviation)*r*math.cos((n+1)*2*math.pi/p_num)-r, \
-                (1+deviation)*r*math.sin((n+1)*2*math.pi/p_num))
-            points.append(new_point)
-
-        if skip_p is not None:
-            points = points[:-skip_p]
+        # Create a set of points that deviate the bottom base circle according to the waveform, without the skipped last points
+        kept_p = p_num - skip_p if skip_p is not None else p_num
+        theta = np.arange(1, kept_p+1)*2*np.pi/p_num
+        deviation = np.asarray(audio_array[:kept_p], dtype=float)
+        x = (1+deviation)*r*np.cos(theta)-r
+        y = (1+deviation)*r*np.sin(theta)
+        points = list(zip(x.tolist(), y.tolist()))
 
         # Create the bottom part of the model
         bot = (
@@ -93,6 +368,50 @@ class SculptureGenerator():
             layer_list: a list of dictionaries, each dictionary represents a layer of the 3D model.
         """
 
+        emotions = tuple((el['class_name'], el['confidence']) for el in response)
+
+        return self.materialize(self.plan_layers(emotions, diameter_limit), self.rng)
+
+    @staticmethod
+    def materialize(plan, rng):
+        """
+        Samples the stochastic layer parameters of a plan.
+
+        Args:
+            plan: a tuple of dictionaries returned by plan_layers.
+            rng: the random number generator providing randint.
+
+        Returns:
+            layer_list: a list of dictionaries, each dictionary represents a layer of the 3D model.
+        """
+
+        layer_list = []
+
+        for layer in plan:
+            layer = dict(layer)
+            if "points_range" in layer:
+                points_range = layer.pop("points_range")
+                layer["points_num"] = rng.randint(*points_range)*layer.pop("points_scale") - layer.pop("points_offset")
+            layer_list.append(layer)
+
+        return layer_list
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def plan_layers(emotions, diameter_limit):
+        """
+        The deterministic part of set_params, cached because generate() calls it with the same response on every retry.
+
+        Args:
+            emotions: a tuple of (class_name, confidence) pairs, one for each emotion detected.
+            diameter_limit: a float number represents the diameter limit.
+
+        Returns:
+            plan: a tuple of dictionaries, the layers with the range of the number of points instead of the number itself where it is random.
+        """
+
+        response = [{'class_name': class_name, 'confidence': confidence} for class_name, confidence in emotions]
+
         bot_limit = r*0.19
         top_limit = r*diameter_limit
         layer_list = []
@@ -102,19 +421,22 @@ class SculptureGenerator():
 
         bot_fillet = False
 
-        satisfied_index = [el['class_name'] for el in response].index('satisfied')
+        # The satisfaction position and confidence do not change between the layers
+        name_to_idx = {el['class_name']: i for i, el in enumerate(response)}
+        satisfied_index = name_to_idx.get('satisfied', len(response))
+        satisfied_early = satisfied_index < min(3, len(response)) and response[satisfied_index]['confidence'] > .15
 
         for i, emotion in enumerate(response):
 
             # Change bot_fillet based on the satisfaction position and confidence
-            if satisfied_index < 3 and response[satisfied_index]['confidence'] > .15 and prev_emotion and prev_emotion['class_name'] != 'frustrated':
+            if satisfied_early and prev_emotion and prev_emotion['class_name'] != 'frustrated':
                 bot_fillet = True
             else:
                 bot_fillet = False
 
             # Satisfaction cannot be used in the third layer because of high deviation
             if (emotion['class_name'] == 'satisfied') and t2_symmetry:
-                if i == 2: return layer_list
+                if i == 2: break
                 emotion = response[0]
 
             # Significantly stronger (0.3 absolute) emotion overwrites the lower level emotion
@@ -124,7 +446,7 @@ class SculptureGenerator():
             # Set layer parameters for frustration
             if emotion['class_name'] == 'frustrated':
 
-                if satisfied_index < 3 and response[satisfied_index]['confidence'] > .15:
+                if satisfied_early:
                     t2_symmetry = True
 
                 radius = r*0.63
@@ -150,13 +472,12 @@ class SculptureGenerator():
                         "symmetry": t2_symmetry
                     })
                 # print('add:', emotion)
-                if layer_list[-1]['points_num'] == 1: return layer_list
+                if layer_list[-1]['points_num'] == 1: break
 
             # Set layer parameters for excitement
             elif emotion['class_name'] == 'excited':
 
-                satisfied_index = [el['class_name'] for el in response].index('satisfied')
-                if satisfied_index < 3 and response[satisfied_index]['confidence'] > .15:
+                if satisfied_early:
                     t2_symmetry = True
 
                 radius = r*0.63
@@ -180,20 +501,23 @@ class SculptureGenerator():
                         "symmetry": t2_symmetry
                     })
                 # print('add:', emotion)
-                if layer_list[-1]['points_num'] == 1: return layer_list
+                if layer_list[-1]['points_num'] == 1: break
 
             # Set layer parameters for sadness
             elif emotion['class_name'] == 'sad':
 
-                poly_points_num = random.randint(17,35)
+                points_scale = 1
                 if emotion["confidence"] > 0.5:
-                    poly_points_num *= 1 + round(emotion["confidence"]/4)
+                    points_scale += round(emotion["confidence"]/4)
 
-                if top_limit-r*i*.15 < bot_limit: return layer_list
+                if top_limit-r*i*.15 < bot_limit: break
                 layer_list.append({
                         "type": 1,
                         "confidence": emotion['confidence'],
-                        "points_num": poly_points_num-i*2,
+                        "points_num": None,
+                        "points_range": (17, 35),
+                        "points_scale": points_scale,
+                        "points_offset": i*2,
                         "radius": top_limit-r*i*.15 if ((i < 2) or (not prev_emotion or (prev_emotion['class_name'] not in ['excited', 'frustrated'])) and (i < 2)) else r*0.15,
                         "edge_fillet": 0.0,
                         "vertex_fillet": 0.0,
@@ -205,12 +529,14 @@ class SculptureGenerator():
             
             # Set layer parameters for sympathy
             elif emotion['class_name'] == 'sympathetic':
-                poly_points_num = random.randint(10,25)
-                if (top_limit-r*i*.15 < bot_limit): return layer_list
+                if (top_limit-r*i*.15 < bot_limit): break
                 layer_list.append({
                         "type": 1,
                         "confidence": emotion['confidence'],
-                        "points_num": poly_points_num-i*2,
+                        "points_num": None,
+                        "points_range": (10, 25),
+                        "points_scale": 1,
+                        "points_offset": i*2,
                         "radius": top_limit-r*i*.15 if ((i < 2) or (not prev_emotion or (prev_emotion['class_name'] not in ['excited', 'frustrated'])) and (i < 2)) else r*0.15,
                         "edge_fillet": r*0.1,
                         "vertex_fillet": r*0.1,
@@ -222,12 +548,14 @@ class SculptureGenerator():
                 
             # Set layer parameters for satisfaction
             elif emotion['class_name'] == 'satisfied':
-                if top_limit-r*i*.2 < bot_limit: return layer_list
-                poly_points_num = random.randint(12,15)
+                if top_limit-r*i*.2 < bot_limit: break
                 layer_list.append({
                         "type": 1,
                         "confidence": emotion['confidence'],
-                        "points_num": poly_points_num-i*3,
+                        "points_num": None,
+                        "points_range": (12, 15),
+                        "points_scale": 1,
+                        "points_offset": i*3,
                         "radius": top_limit-r*i*.2,
                         "edge_fillet": r*0.1,
                         "vertex_fillet": r*0.2,
@@ -240,10 +568,11 @@ class SculptureGenerator():
 
             prev_emotion = emotion
 
+            # The sculpture has at most three layers
             if len(layer_list) == 3:
                 break
             
-        return layer_list
+        return tuple(layer_list)
 
     def get_polygon_points(self, polygon_p_num, pol_r, deviation_arr, symmetry=False):
         """
@@ -259,54 +588,12 @@ class SculptureGenerator():
             polygon_pts: A list of points representing the regular polygon.
         """
 
-        polygon_pts = []
+        # Create the points using the circle equation
+        cos_tab, sin_tab = trig_table(polygon_p_num)
+        deviation = np.asarray(deviation_arr[:polygon_p_num], dtype=float)
+        pts = polygon_core(cos_tab, sin_tab, float(pol_r), deviation, bool(symmetry), r)
 
-        if symmetry:
-            pts_tomap = []
-            temp = None
-            c = 0
-
-            # Create the list of points using the circle equation
-            for n in range(polygon_p_num):
-                deviation = deviation_arr[n]
-                new_point = ((1+deviation)*pol_r*math.cos((n+1)*2*math.pi/polygon_p_num)-r, \
-                    (1+deviation)*pol_r*math.sin((n+1)*2*math.pi/polygon_p_num))
-                c+=1
-                
-                # Add relevant points to the array
-                if new_point[1] >= -r/20 and c == 1:
-                    polygon_pts.append(new_point)
-                    c-=1
-                    if new_point[1] >= r/20:
-                        pts_tomap.append(new_point)
-                elif new_point[1] >= -r/20 and c >= 1:
-                    temp = new_point
-            
-            # Mirror the array on the other side of Y axis
-            pts_tomap = pts_tomap[::-1]
-            for point in pts_tomap:
-                (x,y) = point
-                polygon_pts.append((x,-y))
-            
-            if temp:
-                polygon_pts.append(temp)
-
-        else:
-            # Create the list of points using the circle equation
-            for n in range(polygon_p_num):
-                deviation = deviation_arr[n]
-                new_point = ((1+deviation)*pol_r*math.cos((n+1)*2*math.pi/polygon_p_num)-r, \
-                    (1+deviation)*pol_r*math.sin((n+1)*2*math.pi/polygon_p_num))
-                polygon_pts.append(new_point)
-
-        # Move the points if deviation affected the centre of mass
-        mean_x = sum([el[0] for el in polygon_pts])/len(polygon_pts)
-        mean_y = sum([el[1] for el in polygon_pts])/len(polygon_pts)
-
-        shift_x = -r - mean_x
-        shift_y = -mean_y
-
-        polygon_pts = [(point[0]+shift_x, point[1]+shift_y) for point in polygon_pts]
+        polygon_pts = list(map(tuple, pts.tolist()))
 
         return polygon_pts
 
@@ -328,6 +615,9 @@ class SculptureGenerator():
 
         b_h = self.cur_h
 
+        # The prisms stand on the face nearest to the same point, so the selector is built once
+        base_selector = self.nearest((-r, 0, h/2))
+
         for m, point in enumerate(points):
             circle_r = sizes[m]
             ex_h = heights[m] + h*n/20
@@ -335,11 +625,11 @@ class SculptureGenerator():
             # Put a new prism on the bottom surface
             res = (
                 res
-                .faces(cq.selectors.NearestToPointSelector((-r, 0, h/2)))
+                .faces(base_selector)
                 .center(point[0]-self.old_center[0], point[1]-self.old_center[1])
                 .circle(circle_r)
                 .extrude((b_h-h/2) + ex_h)
-                .faces(cq.selectors.NearestToPointSelector((point[0], point[1], b_h+ex_h)))
+                .faces(self.nearest((point[0], point[1], b_h+ex_h)))
                 .fillet(circle_r)
             )
             
@@ -347,7 +637,7 @@ class SculptureGenerator():
 
         # Apply smoothing to the bottom surface if possible
         if prev_layer and not ((prev_layer['type'] == 2) and prev_layer['polygon_range'] != None) and not ((prev_layer['type'] == 1) and prev_layer['edge_fillet'] != 0):
-            res = res.faces(cq.selectors.NearestToPointSelector((-r,0,self.cur_h))).fillet(r*0.009)
+            res = res.faces(self.nearest((-r,0,self.cur_h))).fillet(r*0.009)
 
         return res
 
@@ -369,26 +659,24 @@ class SculptureGenerator():
 
         b_h = self.cur_h
 
+        # The prisms stand on the face nearest to the same point, so the selector is built once
+        base_selector = self.nearest((-r,0,b_h))
+
         for m, point in enumerate(points):
             circle_r = sizes[m]
             ex_h = heights[m] + h*n/20
 
-            polygon_pts_num = random.randint(polygon_range[0], polygon_range[1])
-            polygon_pts = [(point[0]+r, point[1]) for point in self.get_polygon_points(polygon_pts_num, circle_r, [0.0 for _ in range(polygon_pts_num)], False)]
-            
-            polygon_sketch = (
-                cq.Sketch()
-                .polygon(polygon_pts, tag='face')
-            )
+            polygon_pts_num = self.rng.randint(polygon_range[0], polygon_range[1])
+            polygon_sketch = spike_sketch(polygon_pts_num, round(circle_r, 2))
 
             # Put a new spiky prism on the bottom surface
             res = (
-                res.faces(cq.selectors.NearestToPointSelector((-r,0,b_h)))
+                res.faces(base_selector)
                 .workplane()
                 .center(point[0]-self.old_center[0], point[1]-self.old_center[1])
                 .placeSketch(polygon_sketch)
                 .extrude(0.0001)
-                .faces(cq.selectors.NearestToPointSelector((point[0],point[1],b_h+0.0001)))
+                .faces(self.nearest((point[0],point[1],b_h+0.0001)))
                 .wires(">Z")
                 .toPending()
                 .workplane(offset=ex_h)
@@ -416,7 +704,7 @@ class SculptureGenerator():
             res: The CadQuery model with the generated layer.
         """
 
-        deviation_arr = [random.uniform(0,layer['deviation_range']*0.3) if layer['deviation_range'] != 0 else 0 for n in range(layer["points_num"])]
+        deviation_arr = self.np_rng.uniform(0, layer['deviation_range']*0.3, layer["points_num"]) if layer['deviation_range'] != 0 else np.zeros(layer["points_num"])
         polygon_pts = self.get_polygon_points(layer["points_num"], layer["radius"], deviation_arr, layer['symmetry'])
 
         # Prepare the base polygon
@@ -433,6 +721,9 @@ class SculptureGenerator():
                 .fillet(layer['vertex_fillet'])
             )
 
+        # The layer is extruded from and smoothed at the same bottom face
+        bot_selector = self.nearest((-r,0,self.cur_h))
+
         # Extrude the polygon with smoothing if required
         if last_layer and layer['edge_fillet'] != 0:
 
@@ -443,24 +734,24 @@ class SculptureGenerator():
             
             res = (
                 res
-                .faces(cq.selectors.NearestToPointSelector((-r,0,self.cur_h)))
+                .faces(bot_selector)
                 .workplane().center(0.0-self.old_center[0], 0.0-self.old_center[1])
                 .placeSketch(plane)
                 .extrude(0.0001)
-                .faces(cq.selectors.NearestToPointSelector((-r,0,self.cur_h+0.0001)))
+                .faces(self.nearest((-r,0,self.cur_h+0.0001)))
                 .wires('>Z')
                 .toPending()
                 .workplane(offset=ex_h)
                 .move(-r,0)
                 .circle(layer["radius"])
                 .loft(combine=True, ruled=False)
-                .faces(cq.selectors.NearestToPointSelector((-r,0,self.cur_h+0.0001+ex_h)))
+                .faces(self.nearest((-r,0,self.cur_h+0.0001+ex_h)))
                 .edges('>Z').fillet(layer["radius"]*1/((i+1)))
             )
 
             # Apply smoothing to the bottom surface if possible
             if layer['bot_fillet'] and not (prev_layer and (prev_layer['type'] == 2)):
-                res = res.faces(cq.selectors.NearestToPointSelector((-r,0,self.cur_h))).fillet(h/(20*((i+1))))
+                res = res.faces(bot_selector).fillet(h/(20*((i+1))))
 
             self.cur_h += 0.0001+ex_h
         
@@ -474,21 +765,21 @@ class SculptureGenerator():
 
             res = (
                 res
-                .faces(cq.selectors.NearestToPointSelector((-r,0,self.cur_h))) 
+                .faces(bot_selector)
                 .workplane().center(0.0-self.old_center[0], 0.0-self.old_center[1])
                 .placeSketch(plane)
                 .extrude(ex_h)
             )
 
             if (layer['bot_fillet']) and (prev_layer['type'] != 2):
-                res = res.faces(cq.selectors.NearestToPointSelector((-r,0,self.cur_h))).fillet(h/(12*((i+1))))
+                res = res.faces(bot_selector).fillet(h/(12*((i+1))))
 
             self.cur_h += ex_h
 
             if layer['edge_fillet'] != 0:
                 res = (
                     res
-                    .faces(cq.selectors.NearestToPointSelector((-r,0,self.cur_h+0.0001)))
+                    .faces(self.nearest((-r,0,self.cur_h+0.0001)))
                     .edges('>Z').fillet(layer['edge_fillet']/(i+1))
                 )
         
@@ -515,17 +806,20 @@ class SculptureGenerator():
         # If it's not the last layer of the sculpture
         if layer['points_num'] > 1:
 
-            heights = [h*round(random.uniform(0.1401, max((0.3/0.6)*layer['confidence'],0.15)), 4) for _ in range(layer['points_num'])]  # emotion confidence defines the height range
-            sizes = [r*random.uniform(0.08, 0.14) for _ in range(layer['points_num'])]
+            points_num = layer['points_num']
+            heights = h*np.round(self.np_rng.uniform(0.1401, max((0.3/0.6)*layer['confidence'],0.15), points_num), 4)  # emotion confidence defines the height range
+            sizes = r*self.np_rng.uniform(0.08, 0.14, points_num)
 
             # Apply symmetry if necessary
             if layer['symmetry'] == True:
                 # Heights and sizes are symmetrical
-                for n in range(layer['points_num']//2):
-                    heights[layer['points_num']-2-n] = heights[n]
-                    sizes[layer['points_num']-2-n] = sizes[n]
+                half = points_num//2
+                heights[points_num-1-half:points_num-1] = heights[:half][::-1]
+                sizes[points_num-1-half:points_num-1] = sizes[:half][::-1]
 
-            deviation_arr = [random.uniform(0,layer['deviation_range']*0.3) if layer['deviation_range'] != 0 else 0 for n in range(layer["points_num"])]
+            heights, sizes = heights.tolist(), sizes.tolist()
+
+            deviation_arr = self.np_rng.uniform(0, layer['deviation_range']*0.3, points_num) if layer['deviation_range'] != 0 else np.zeros(points_num)
             points = self.get_polygon_points(layer['points_num'], layer['radius'], deviation_arr, layer['symmetry'])
 
             # Call the relevant modelling function
@@ -541,8 +835,8 @@ class SculptureGenerator():
             # If the base is circular
             if layer['polygon_range'] == None:
                 if b_h == h/2:
-                    circle_r = r*random.uniform(0.1, 0.18)
-                    ex_h = round(h*random.uniform(0.1401, max((0.3/0.6)*layer['confidence'],0.15)), 4) + h*6/35
+                    circle_r = r*self.rng.uniform(0.1, 0.18)
+                    ex_h = round(h*self.rng.uniform(0.1401, max((0.3/0.6)*layer['confidence'],0.15)), 4) + h*6/35
                 else:
                     circle_r = r*0.12
                     ex_h = h*0.2
@@ -550,37 +844,32 @@ class SculptureGenerator():
                 # Put one hemispheric prism in the middle
                 res = (
                     res
-                    .faces(cq.selectors.NearestToPointSelector((-r,0,h/2)))
+                    .faces(self.nearest((-r,0,h/2)))
                     .center(-self.old_center[0]-r, -self.old_center[1])
                     .circle(circle_r)
                     .extrude((b_h-h/2) + ex_h)
-                    .faces(cq.selectors.NearestToPointSelector((-r,0.0,b_h+ex_h)))
+                    .faces(self.nearest((-r,0.0,b_h+ex_h)))
                     .fillet(circle_r)
                 )
             
             # If the base is a polygon
             else:
-                circle_r = r*random.uniform(0.1, 0.18)
-                ex_h = round(h*random.uniform(0.1401, max((0.3/0.6)*layer['confidence'],0.15)), 4) + h*6/35
+                circle_r = r*self.rng.uniform(0.1, 0.18)
+                ex_h = round(h*self.rng.uniform(0.1401, max((0.3/0.6)*layer['confidence'],0.15)), 4) + h*6/35
 
-                polygon_pts_num = random.randint(layer['polygon_range'][0], layer['polygon_range'][1])
-                polygon_pts = [(point[0]+r, point[1]) for point in self.get_polygon_points(polygon_pts_num, circle_r, [0.0 for _ in range(polygon_pts_num)], False)]
-
-                polygon_sketch = (
-                    cq.Sketch()
-                    .polygon(polygon_pts, tag='face')
-                )
+                polygon_pts_num = self.rng.randint(layer['polygon_range'][0], layer['polygon_range'][1])
+                polygon_sketch = spike_sketch(polygon_pts_num, round(circle_r, 2))
 
                 # Put one spiky prism in the middle
                 res = (
                     res
-                    .faces(cq.selectors.NearestToPointSelector((-r,0,b_h)))
+                    .faces(self.nearest((-r,0,b_h)))
                     .workplane()
                     .center(-self.old_center[0]-r, -self.old_center[1])
                     .placeSketch(polygon_sketch)
                     .extrude(0.0001)
-                    .faces(cq.selectors.NearestToPointSelector((-r,0.0,b_h+0.0001)))
-                    .wires(cq.selectors.NearestToPointSelector((-r,0.0,b_h+0.0001)))
+                    .faces(self.nearest((-r,0.0,b_h+0.0001)))
+                    .wires(self.nearest((-r,0.0,b_h+0.0001)))
                     .toPending()
                     .workplane(offset=ex_h)
                     .circle(0.0001)
@@ -611,15 +900,25 @@ class SculptureGenerator():
 
         # Call the relevant function for each layer
         for i, layer in enumerate(layer_list):
-            print(layer)
+            logger.debug("layer: %r", layer)
 
             if i == len(layer_list) - 1:
                 last_layer = True
 
-            if layer['type'] == 1 :
-                res = self.gen_type1(res, layer, i, prev_layer, last_layer)
-            elif layer['type'] == 2:
-                res = self.gen_type2(res, layer, i, prev_layer)
+            # Only the failed layer is rebuilt, the model of the previous layers is kept
+            state = self.snapshot()
+            for attempt in range(layer_retries):
+                try:
+                    if layer['type'] == 1 :
+                        res = self.gen_type1(res, layer, i, prev_layer, last_layer)
+                    elif layer['type'] == 2:
+                        res = self.gen_type2(res, layer, i, prev_layer)
+                    break
+                except GEOMETRY_ERRORS:
+                    self.restore(state)
+                    if attempt == layer_retries - 1:
+                        raise
+                    logger.debug('Incompatible layer %d, regenerating...', i)
             
             prev_layer = layer
 
@@ -638,45 +937,73 @@ class SculptureGenerator():
         """
 
         # -- Create the bottom part of the sculpture with the waveform curvature. Skip the last audio array elements or generate a random array on failure.
-        fail_count = 0
+
+        # The cached face centres only stay useful while the same model is being built
+        self.face_centers = {}
+
+        # Each waveform configuration is deterministic, so it is built at most once
+        bases = {}
+        def waveform_base(skip_p):
+            if skip_p not in bases:
+                try:
+                    bases[skip_p] = self.gen_waveform_base(p_num, r, h, audio_array, skip_p=skip_p)
+                except GEOMETRY_ERRORS:
+                    bases[skip_p] = None
+            return bases[skip_p]
+
+        # The random array is only drawn again when it could not produce the base
+        rand_audio = None
+        def random_base():
+            nonlocal rand_audio
+            if rand_audio is None:
+                rand_audio = self.np_rng.uniform(-0.04, 0.04, p_num).round(4)
+            try:
+                return self.gen_waveform_base(p_num, r, h, rand_audio, rand_base=True)
+            except GEOMETRY_ERRORS:
+                rand_audio = None
+                return None
+
+        # A short or corrupted waveform can never produce the base
+        audio_valid = len(audio_array) >= p_num and np.isfinite(np.asarray(audio_array[:p_num], dtype=float)).all()
 
         bot = None
+        if audio_valid:
+            for skip_p in (None, 1, 2):
+                bot = waveform_base(skip_p)
+                if bot is not None:
+                    break
         while bot is None:
-            try:
-                if fail_count == 1:
-                    bot = self.gen_waveform_base(p_num, r, h, audio_array, skip_p=1)
-                elif fail_count == 2:
-                    bot = self.gen_waveform_base(p_num, r, h, audio_array, skip_p=2)
-                elif fail_count >= 3:
-                    bot = self.gen_waveform_base(p_num, r, h, audio_array, rand_base=True)
-                else:
-                    bot = self.gen_waveform_base(p_num, r, h, audio_array)
-            except:
-                fail_count += 1
+            bot = random_base()
 
         # -- Add the top model depending on the emotion
 
         # Stochastic elements make the function throw ValueError in some cases
         fail_count = 0
+        top_state = {"old_center": (0.0, 0.0), "cur_h": h/2, "recent_points": []}
 
         top = None
         while top is None:
             try:
-                print(response)
-                if (fail_count >= 7) and (fail_count < 14): # remove the last array point if failed 7 times
-                    bot = self.gen_waveform_base(p_num, r, h, audio_array, skip_p=1)
-                elif (fail_count >= 14) and (fail_count < 21): # remove the 2 last array points if failed 14 times
-                    bot = self.gen_waveform_base(p_num, r, h, audio_array, skip_p=2)
-                elif fail_count >= 21: # generate a random array if failed 21 times
-                    bot = self.gen_waveform_base(p_num, r, h, audio_array, rand_base=True)
+                logger.debug("response: %r", response)
                 top = self.shape_top(bot, response)
-            except:
-                self.old_center = (0.0, 0.0)
-                self.cur_h = h/2
-                self.recent_points = []
-                print('Incompatible layers, regenerating...')
+            except GEOMETRY_ERRORS:
+                self.restore(top_state)
+                logger.debug('Incompatible layers, regenerating...')
                 fail_count += 1
 
+                # Seed the retries so that a failing configuration can be replayed
+                self.rng.seed(fail_count)
+                self.np_rng = np.random.default_rng(fail_count)
+
+                # The bottom part is reused between the retries and only rebuilt when the strategy changes
+                new_bot = None
+                if audio_valid and fail_count in (7, 14): # remove the last 1 or 2 array points if failed 7 or 14 times
+                    new_bot = waveform_base(fail_count//7)
+                elif fail_count >= 21: # generate a random array if failed 21 times
+                    new_bot = random_base()
+                if new_bot is not None:
+                    bot = new_bot
+
         result = top
 
         return result
\ No newline at end of file
@@ -1,13 +1,197 @@
 import os
 import io
+import logging
+import subprocess
 
-import pyaudio
+import numba
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
 from pydub import AudioSegment
+from pydub.audio_segment import fix_wav_headers
+from pydub.exceptions import CouldntDecodeError
 from pydub.playback import play
 
+logger = logging.getLogger(__name__)
+
+# Render plots off screen, a GUI backend would block the request thread
+matplotlib.use('Agg')
+
 p_num = 50
+hampel_w = 3 # Half-width of the Hampel filter window in samples
+hampel_k = 3. # Hampel filter threshold in scaled median absolute deviations
+
+@numba.njit(cache=True, error_model='numpy')
+def normalise_kernel(p_audio_array, m, lo, hi):
+    """
+    Replaces the outliers of the reduced audio data and normalises it in place, see process.
+
+    Args:
+        p_audio_array (numpy.ndarray): Reduced audio data as a float64 NumPy array.
+        m (float): Outlier threshold, see impute_outliers.
+        lo (float): The lower bound of the normalised data.
+        hi (float): The upper bound of the normalised data.
+
+    Returns:
+        numpy.ndarray: The processed p_audio_array.
+    """
+
+    # Replace any significant outliers with mean audio value
+    d = np.abs(p_audio_array - np.median(p_audio_array))
+    mdev = np.median(d)
+    if mdev > 0:
+        mean = p_audio_array.mean()
+        for i in range(p_audio_array.shape[0]):
+            if d[i] >= m*mdev:
+                p_audio_array[i] = mean
+
+    # Normalise the array in place with one affine map, constant data maps to the upper bound like np.interp did
+    a_min = p_audio_array.min()
+    a_max = p_audio_array.max()
+    if a_max > a_min:
+        scale = (hi - lo) / (a_max - a_min)
+        for i in range(p_audio_array.shape[0]):
+            p_audio_array[i] = (p_audio_array[i] - a_min)*scale + lo
+    else:
+        p_audio_array[:] = hi
+
+    return p_audio_array
+
+@numba.njit(cache=True, error_model='numpy')
+def process_kernel(audio_array, p_num, m, lo, hi):
+    """
+    Bins the audio data, replaces the outliers and normalises the result in one compiled pass, see process.
+
+    Args:
+        audio_array (numpy.ndarray): Audio data as a NumPy array.
+        p_num (int): The number of bins.
+        m (float): Outlier threshold, see impute_outliers.
+        lo (float): The lower bound of the normalised data.
+        hi (float): The upper bound of the normalised data.
+
+    Returns:
+        numpy.ndarray: Processed audio data as a NumPy array.
+    """
+
+    n = audio_array.shape[0]
+
+    # Shorter data leaves some bins empty, the result is NaN like the mean of an empty bin so that the sculpture falls back to a random base
+    if n < p_num:
+        return np.full(p_num, np.nan)
+
+    p_audio_array = np.empty(p_num)
+
+    # Calculate the mean of every bin, the bins are split like np.linspace(0, n, p_num+1) would
+    step = n / p_num
+    start = 0
+    for i in range(p_num):
+        end = n if i == p_num-1 else int((i+1)*step)
+
+        # Integer samples are summed exactly in int64, which LLVM can vectorise unlike a float sum, float data is summed in float64
+        total = 0
+        for k in range(start, end):
+            total += audio_array[k]
+        p_audio_array[i] = total / (end - start)
+        start = end
+
+    return normalise_kernel(p_audio_array, m, lo, hi)
+
+@numba.njit(cache=True)
+def hampel(x, w, k):
+    """
+    Replaces the samples that deviate from the median of their window by more than k scaled median absolute deviations with that median.
+
+    Args:
+        x (numpy.ndarray): Audio data as a NumPy array, it is not modified.
+        w (int): Half-width of the window, the window of every sample holds up to 2*w+1 samples.
+        k (float): Outlier threshold in median absolute deviations scaled to the standard deviation.
+
+    Returns:
+        numpy.ndarray: Filtered audio data as a new NumPy array of the same type.
+    """
+
+    n = x.shape[0]
+    y = np.empty_like(x)
+    window = np.empty(2*w+1)
+    dev = np.empty(2*w+1)
+
+    for i in range(n):
+        # Insertion sort the window, it is truncated at the ends of the data
+        lo = max(0, i-w)
+        size = min(n, i+w+1) - lo
+        for j in range(size):
+            v = float(x[lo+j])
+            t = j
+            while t > 0 and window[t-1] > v:
+                window[t] = window[t-1]
+                t -= 1
+            window[t] = v
+
+        # Take the upper median so that the replacement is always one of the samples
+        med = window[size//2]
+
+        # Sort the absolute deviations from the median the same way
+        for j in range(size):
+            v = abs(window[j] - med)
+            t = j
+            while t > 0 and dev[t-1] > v:
+                dev[t] = dev[t-1]
+                t -= 1
+            dev[t] = v
+        mad = dev[size//2]
+
+        y[i] = med if abs(x[i] - med) > k*1.4826*mad else x[i]
+
+    return y
+
+# Compile or load the kernel for the read-only arrays of every native sample type at import instead of on the first upload, the opt-in Hampel filter compiles on its first use
+for sample_type in ('b', 'h', 'i'):
+    process_kernel(np.frombuffer(bytes(p_num*np.dtype(sample_type).itemsize), dtype=sample_type), p_num, 7., -0.04, 0.04)
+normalise_kernel(np.zeros(p_num), 7., -0.04, 0.04)
+
+def decode(stream):
+    """
+    Decodes a compressed audio stream with a single ffmpeg call that reads from stdin and writes to a pipe.
+
+    Args:
+        stream: A file-like object of the encoded audio file, read from its start.
+
+    Returns:
+        AudioSegment: The decoded 16-bit audio with the original channels and sample rate.
+    """
+
+    stream.seek(0)
+
+    # Let ffmpeg read a stream backed by a file on disk directly, asking a SpooledTemporaryFile still in memory for its descriptor would write it to disk first
+    fd = None
+    if getattr(stream, '_rolled', True):
+        try:
+            fd = stream.fileno()
+        except (AttributeError, OSError):
+            pass
+
+    # An in-memory stream is written to ffmpeg's stdin
+    if fd is None:
+        stdin, audio_data = subprocess.PIPE, stream.read()
+    else:
+        stdin, audio_data = stream, None
+
+    # Let ffmpeg detect the format itself, pydub runs ffprobe for this first and then writes the result through a WAV pipe as well
+    p = subprocess.Popen(
+        [AudioSegment.converter, '-v', 'error', '-i', 'cache:pipe:0', '-vn', '-acodec', 'pcm_s16le', '-f', 'wav', '-'],
+        stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    p_out, p_err = p.communicate(input=audio_data)
+
+    if p.returncode != 0 or len(p_out) == 0:
+        raise CouldntDecodeError(
+            f"Decoding failed. ffmpeg returned error code: {p.returncode}\n\n{p_err.decode(errors='ignore')}"
+        )
+
+    # The sizes in the header of a piped WAV are unknown, set them before pydub parses it
+    p_out = bytearray(p_out)
+    fix_wav_headers(p_out)
+
+    return AudioSegment(bytes(p_out))
 
 class WaveProcessor():
     """
@@ -19,7 +203,8 @@ class WaveProcessor():
         sample_rate (float): The sample rate of the audio file.
         duration (float): The duration of the audio file.
         frequency (float): The frequency of the audio file.
-        audio_array (ndarray): A NumPy array containing the audio data.
+        audio_array (ndarray): A NumPy array containing the audio data mixed down to mono.
+        plot (io.BytesIO): A PNG image of the processed audio data, set by process if asked to plot.
     """
 
     def __init__(self, file):
@@ -27,36 +212,36 @@ class WaveProcessor():
         Initializes WaveProcessor object with the given file.
 
         Args:
-            file: File object to read the audio data from.
+            file: Uploaded file object to read the audio data from through its stream.
 
         Returns:
             None
         """
 
         file_path = file.filename
-        print(file_path)
+        root, ext = os.path.splitext(file_path)
 
-        # Extract the file format from the string
-        self.file_format = os.path.splitext(file_path)[1][1:]
-        print(self.file_format)
-
-        # Extract the filename from the path
-        self.file_name = os.path.basename(os.path.splitext(file_path)[0])
-        print(self.file_name)
+        # Extract the file format and the filename from the path
+        self.file_format = ext[1:]
+        self.file_name = os.path.basename(root)
+        logger.debug("file: %s, name: %s, format: %s", file_path, self.file_name, self.file_format)
         
-        # Load the audio file into an AudioSegment object
-        audio_data = file.read()
-        audio = AudioSegment.from_file(
-            io.BytesIO(audio_data), format=self.file_format
-        )
+        # Load the audio file into an AudioSegment object straight from the upload's stream, WAV files are parsed by pydub and anything else is decoded by ffmpeg
+        if self.file_format == "wav":
+            audio = AudioSegment.from_file(file.stream, format=self.file_format)
+        else:
+            audio = decode(file.stream)
 
         # Extract the sample rate, duration, and frequency
-        self.sample_rate = audio.frame_rate / audio.channels
+        self.sample_rate = audio.frame_rate
         self.duration = audio.frame_count() / audio.frame_rate
         self.frequency = audio.frame_rate / 2
 
-        # Extract the audio data as a NumPy array
-        self.audio_array = np.array(audio.get_array_of_samples())
+        # Mix the channels down so that the array holds one sample per frame instead of interleaved channels
+        mono = audio.set_channels(1) if audio.channels > 1 else audio
+
+        # View the raw audio data as a read-only NumPy array of the native sample type without copying it
+        self.audio_array = np.frombuffer(mono.raw_data, dtype=mono.array_type)
 
         self.audio = audio
     
@@ -81,14 +266,24 @@ class WaveProcessor():
             audio_array (numpy.ndarray): Audio data to plot as a graph. If None, plots the audio data stored in the object.
 
         Returns:
-            None
+            io.BytesIO: The graph as a PNG image.
         """
 
+        # Import pyplot only when plotting so that loading the module stays cheap
+        import matplotlib.pyplot as plt
+
         if audio_array is None:
             audio_array = self.audio_array
 
+        fig = plt.figure()
         plt.plot(audio_array)
-        plt.show()
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png')
+        plt.close(fig)
+        buf.seek(0)
+
+        return buf
     
     def play_audio(self):
         """
@@ -102,23 +297,20 @@ class WaveProcessor():
         """
 
         if self.file_format == "wav":
-            chunk = 1024  
+            # PyAudio is only needed for the playback
+            import pyaudio
+
             # Create an interface to PortAudio
             p = pyaudio.PyAudio()
 
-            # Open a .Stream object to write the MP3 file to
-            stream = p.open(format = p.get_format_from_width(self.audio.getsampwidth()),
-            channels = self.audio.getnchannels(),
-            rate = self.audio.getframerate(),
+            # Open a .Stream object with the format of the loaded audio
+            stream = p.open(format = p.get_format_from_width(self.audio.sample_width),
+            channels = self.audio.channels,
+            rate = self.audio.frame_rate,
             output = True)
 
-            # Read data in chunks
-            data = self.audio.readframes(chunk)
-
-            # Play the sound by writing the audio data to the stream
-            while data != '':
-                stream.write(data)
-                data = self.audio.readframes(chunk)
+            # Play the sound by writing all of the audio data to the stream at once
+            stream.write(self.audio.raw_data)
 
             # Close and terminate the stream
             stream.close()
@@ -126,17 +318,18 @@ class WaveProcessor():
         else:
             play(self.audio)
 
-    def save_to_mp3(self, audio_path=""):
+    def save_to_mp3(self, audio_path=None):
         """
         Saves the audio file as a MP3 file.
 
         Args:
-            audio_path (str): Path to save the MP3 file. If empty, saves to the current directory with the original file name.
+            audio_path (str): Path of an audio file on disk to convert. If None, the already decoded audio of this object is saved. The MP3 file is saved to audio_processed with the file's name.
 
         Returns:
             str: Path to the saved MP3 file.
         """
 
+        # Reuse the decoded audio unless a file on disk is given
         if not audio_path:
             audio = self.audio
             file_name = self.file_name
@@ -154,6 +347,23 @@ class WaveProcessor():
 
         return export_path
 
+    def encode_mp3(self):
+        """
+        Encodes the audio file as MP3 in memory.
+
+        Args:
+            None
+
+        Returns:
+            io.BytesIO: The MP3 file.
+        """
+
+        buf = io.BytesIO()
+        self.audio.export(buf, format="mp3")
+        buf.seek(0)
+
+        return buf
+
     def impute_outliers(self, data, m = 7.):
         """
         Replaces any significant outliers with the mean audio value.
@@ -169,18 +379,25 @@ class WaveProcessor():
         d = np.abs(data - np.median(data))
         mdev = np.median(d)
 
-        s = d/mdev if mdev else np.zero(len(d))
-        data[s>=m] = np.mean(data)
+        # Nothing is an outlier if more than half of the data is equal to the median
+        if mdev == 0:
+            return data
+
+        outliers = d >= m*mdev
+        if outliers.any():
+            data[outliers] = np.mean(data)
 
         return data
 
-    def process(self, plot = False, save=False):
+    def process(self, plot = False, save=False, mode='mean', despike=False):
         """
         Processes the audio data by reducing its size, replacing outliers and normalizing the data.
 
         Args:
-            plot (bool): If True, plots the processed audio data.
-            save (bool): If True, saves the processed audio data as a CSV file.
+            plot (bool): If True, plots the processed audio data as a PNG image in the plot attribute.
+            save (bool): If True, saves the processed audio data as raw float32 values to audio_array.f32, read it back with np.fromfile(path, dtype=np.float32).
+            mode (str): 'mean' to reduce the data to the means of p_num bins, 'stride' to take every few elements without reading the rest.
+            despike (bool): If True, runs a Hampel filter over the raw samples before reducing them, this costs about 25 times as much as the reduction.
 
         Returns:
             numpy.ndarray: Processed audio data as a NumPy array.
@@ -188,23 +405,24 @@ class WaveProcessor():
 
         audio_array = self.get_audio_array()
 
-        # Calculate the number of elements to take the average from to fill each element in the new array
-        average_size = len(audio_array) // p_num
-
-        # Create an empty array with the desired size
-        p_audio_array = np.empty(p_num)
-
-        # Calculate the mean of every few elements and store the result in the new array
-        for i in range(p_num):
-            p_audio_array[i] = np.mean(audio_array[i*average_size:(i+1)*average_size])
-
-        # Replace any significant outliers with mean audio value
-        p_audio_array = self.impute_outliers(p_audio_array)
-
-        # Normalise the array
-        p_audio_array = np.interp(p_audio_array, (p_audio_array.min(), p_audio_array.max()), (-0.04, 0.04))
+        # Replace the outliers at sample granularity before they are smeared into the bin means
+        if despike:
+            audio_array = hampel(audio_array, hampel_w, hampel_k)
+
+        if mode == 'mean':
+            # Bin the data, replace the outliers and normalise it in a single compiled pass
+            p_audio_array = process_kernel(audio_array, p_num, 7., -0.04, 0.04)
+        elif mode == 'stride':
+            # Decimate the data without anti-aliasing, only p_num elements are read, shorter data is NaN as in the mean mode
+            if len(audio_array) < p_num:
+                p_audio_array = np.full(p_num, np.nan)
+            else:
+                stride = len(audio_array) // p_num
+                p_audio_array = normalise_kernel(audio_array[:stride*p_num:stride].astype(np.float64), 7., -0.04, 0.04)
+        else:
+            raise ValueError(f"Unknown processing mode: {mode}")
 
-        if plot: self.plot_audio_array(p_audio_array)
-        if save: np.savetxt('audio_array.csv', p_audio_array, delimiter=',')
+        if plot: self.plot = self.plot_audio_array(p_audio_array)
+        if save: p_audio_array.astype(np.float32).tofile('audio_array.f32')
 
         return p_audio_array
\ No newline at end of file
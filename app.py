@@ -1,6 +1,8 @@
 from flask import Flask, request, send_file, render_template
 import cadquery as cq
 import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from WaveProcessor import WaveProcessor
 from EmotionExtractor import EmotionExtractor
@@ -8,6 +10,9 @@ from SculptureGenerator import SculptureGenerator
 
 app = Flask(__name__)
 
+# Encodes the MP3 files for emotion extraction in the background
+export_pool = ThreadPoolExecutor(max_workers=2)
+
 @app.route('/')
 def home():
     return render_template('website.html')
@@ -19,11 +24,11 @@ def upload_file():
     """
     file = request.files['file']
 
-    # Process audio and return audio array and the path to WAV file
-    p_audio_array, mp3_path = process_audio(file)
+    # Process audio and return audio array and the MP3 file
+    p_audio_array, mp3 = process_audio(file)
 
     # Extract emotions from the audio recording using IBM Speech-to-text and IBM Natural Language Understanding tools
-    response = extract_emotions(mp3_path)
+    response = extract_emotions(mp3)
 
     # Generate the sculpture
     outputfile = generate_sculpture(response, p_audio_array)
@@ -38,36 +43,38 @@ def process_audio(file):
         file: The audio file to process.
         
     Returns:
-        tuple: A tuple containing the processed audio array and the path to the saved WAV file.
+        tuple: A tuple containing the processed audio array and the MP3 file as an in-memory buffer.
     """
 
     print("Processing audio...")
     w_proc = WaveProcessor(file)
 
+    # Prepare audio for emotion extraction, the MP3 is encoded in memory while the audio is prepared for modelling
+    mp3_future = export_pool.submit(w_proc.encode_mp3)
+
     # Prepare audio for modelling
     p_audio_array = w_proc.process()
 
-    # Prepare audio for emotion extraction
-    mp3_path = w_proc.save_to_mp3()
+    mp3 = mp3_future.result()
 
-    return p_audio_array, mp3_path
+    return p_audio_array, mp3
 
-def extract_emotions(path):
+def extract_emotions(audio):
     """
     Extracts emotions from an audio file using IBM Speech-to-Text and Natural Language Understanding tools.
     
     Args:
-        path: The path to the audio file.
+        audio: The path to the audio file or a file-like object of it.
         
     Returns:
         list: A list of dictionaries containing the emotion classes and confidences.
     """
     
     print("Extracting emotions...")
-    em_extractor = EmotionExtractor()
+    em_extractor = EmotionExtractor(prewarm=True)
 
     # Get text from recording
-    text = em_extractor.get_stt_response(path)
+    text = em_extractor.get_stt_response(audio)
 
     # Get emotions from text
     response = em_extractor.get_nlu_response(text)
@@ -108,4 +115,5 @@ def generate_sculpture(response, p_audio_array):
     return outputfile
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     app.run()
\ No newline at end of file
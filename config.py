@@ -2,8 +2,26 @@
 NLU_MODEL_ID = "tone-classifications-en-v1"
 NLU_API_KEY = "YOUR_API_KEY_HERE"
 NLU_URL = "YOUR_URL_HERE"
+NLU_MAX_WORKERS = 8 # Number of concurrent analyses
+NLU_MIN_CHARS = 40 # Minimum length of a transcript part analysed during the transcription
+NLU_CACHE_DIR = ".nlu_cache" # Directory storing the emotions of the previously analysed texts
 
 # STT Tool
+STT_BACKEND = "watson" # "watson" for IBM Watson Speech-to-Text or "faster-whisper" for a local Whisper model
 STT_API_KEY = "YOUR_API_KEY_HERE"
 STT_URL = "YOUR_URL_HERE"
-STT_MODEL_ID = "en-GB_Multimedia"
\ No newline at end of file
+STT_MODEL_ID = "en-GB_Multimedia"
+STT_SEGMENT_SECONDS = 45 # Length of the audio segments transcribed in parallel
+STT_MAX_WORKERS = 5 # Number of concurrent recognitions allowed per account
+STT_STREAM_CHUNK_BYTES = 65536 # Size of the audio pieces sent over the WebSocket
+STT_MIN_SPLIT_BYTES = 16384 # Smallest segment split in half when its recognition keeps timing out
+ENABLE_VAD_GATE = True # Skip the transcription of silent recordings
+VAD_RMS_THRESHOLD = 0.01 # RMS level below which a 100 ms frame is considered silent
+STT_CACHE_DIR = ".stt_cache" # Directory storing the transcripts of the previously seen recordings
+WHISPER_MODEL = "medium" # Size of the faster-whisper model
+WHISPER_DEVICE = "cuda"
+WHISPER_COMPUTE_TYPE = "int8_float16"
+
+# IBM Cloud
+API_RETRIES = 4 # Number of attempts for a call failing with a transient error
+API_RATE_LIMIT_WAIT = 5 # Additional seconds to wait after a call is rejected for exceeding the rate limits
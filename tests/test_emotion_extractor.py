@@ -0,0 +1,145 @@
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+from concurrent.futures import Future
+
+from ibm_watson import ApiException
+
+import config
+import EmotionExtractor as emotion_extractor
+from EmotionExtractor import EmotionExtractor, websocket_error_code, is_transient_error
+
+def resolved(result=None, exception=None):
+    future = Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+def use_temporary_cache_dirs(test):
+    tmp = tempfile.TemporaryDirectory()
+    test.addCleanup(tmp.cleanup)
+    patcher = mock.patch.multiple(config, NLU_CACHE_DIR=tmp.name + '/nlu', STT_CACHE_DIR=tmp.name + '/stt')
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+class WebSocketErrorTest(unittest.TestCase):
+
+    def test_session_timeout_is_split_code(self):
+        self.assertEqual(websocket_error_code("Session timed out."), 408)
+
+    def test_service_messages_are_not_retried(self):
+        code = websocket_error_code("Unable to transcode data stream audio/ogg -> audio/x-float-array")
+        self.assertEqual(code, 400)
+        self.assertFalse(is_transient_error(ApiException(code)))
+
+    def test_connection_errors_keep_their_code(self):
+        self.assertEqual(websocket_error_code(ConnectionResetError()), 500)
+
+class HttpSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        use_temporary_cache_dirs(self)
+
+    def test_extractors_share_the_keep_alive_session(self):
+        self.assertIs(EmotionExtractor().session, EmotionExtractor().session)
+
+class AsyncProcessTest(unittest.TestCase):
+
+    def setUp(self):
+        use_temporary_cache_dirs(self)
+
+    def test_process_runs_in_several_event_loops(self):
+        em_extractor = EmotionExtractor()
+        paths = ['recording.mp3']*(config.STT_MAX_WORKERS + 1)
+        emotions = [{'class_name': 'sad', 'confidence': 0.5}]
+
+        with mock.patch.object(em_extractor, 'get_stt_response', return_value='text'), \
+                mock.patch.object(em_extractor, 'get_nlu_response', return_value=emotions):
+            for _ in range(2):
+                self.assertEqual(asyncio.run(em_extractor.process(paths)), [emotions]*len(paths))
+
+class WhisperBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        use_temporary_cache_dirs(self)
+        emotion_extractor.whisper_backend.cache_clear()
+        self.addCleanup(emotion_extractor.whisper_backend.cache_clear)
+
+    def test_model_is_loaded_once_per_process(self):
+        with mock.patch.object(config, 'STT_BACKEND', 'faster-whisper'), \
+                mock.patch.object(emotion_extractor, 'FasterWhisperBackend') as backend:
+            first, second = EmotionExtractor().stt_backend, EmotionExtractor().stt_backend
+
+        self.assertIs(first, second)
+        backend.assert_called_once_with(config.WHISPER_MODEL, config.WHISPER_DEVICE, config.WHISPER_COMPUTE_TYPE)
+
+class DecodingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        use_temporary_cache_dirs(self)
+        emotion_extractor.load_speech.cache_clear()
+        emotion_extractor.transcode_segments.cache_clear()
+
+    def test_in_memory_upload_is_not_cached(self):
+        decoded = mock.Mock()
+        with mock.patch.object(emotion_extractor, 'decode_speech', return_value=decoded) as decode_speech, \
+                mock.patch.object(emotion_extractor, 'export_segments', return_value=(b'segment',)) as export_segments:
+            segments = EmotionExtractor().segment_audio(b'encoded audio')
+
+        self.assertEqual(segments, [b'segment'])
+        decode_speech.assert_called_once_with(b'encoded audio')
+        export_segments.assert_called_once_with(decoded, config.STT_SEGMENT_SECONDS)
+        self.assertEqual(emotion_extractor.load_speech.cache_info().currsize, 0)
+        self.assertEqual(emotion_extractor.transcode_segments.cache_info().currsize, 0)
+
+class PartialAnalysesTest(unittest.TestCase):
+
+    def setUp(self):
+        use_temporary_cache_dirs(self)
+
+        self.full = [{'class_name': 'sad', 'confidence': 0.116}, {'class_name': 'excited', 'confidence': 0.1}]
+        self.parts = ("a"*40, "b"*60)
+        self.text = ''.join(self.parts)
+
+    def extractor(self, analyses):
+        em_extractor = EmotionExtractor()
+        em_extractor.text = self.text
+        em_extractor.partial_analyses = (self.text, analyses)
+        return em_extractor
+
+    def test_merged_emotions_are_cached_under_the_transcript(self):
+        analyses = [
+            (40, resolved([{'class_name': 'excited', 'confidence': 0.2}])),
+            (60, resolved([{'class_name': 'sad', 'confidence': 0.1}])),
+        ]
+        fresh = self.extractor(analyses)
+        with mock.patch.object(fresh, '_analyze', return_value=self.full) as analyze:
+            merged = fresh.get_nlu_response()
+        analyze.assert_not_called()
+
+        # A cached transcript comes without the analyses of its parts
+        cached = self.extractor([])
+        with mock.patch.object(cached, '_analyze', return_value=self.full) as analyze:
+            self.assertEqual(cached.get_nlu_response(), merged)
+        analyze.assert_not_called()
+
+    def test_whole_text_is_analysed_when_a_part_was_skipped(self):
+        em_extractor = self.extractor([(60, resolved([{'class_name': 'sad', 'confidence': 0.1}]))])
+        with mock.patch.object(em_extractor, '_analyze', return_value=self.full) as analyze:
+            self.assertEqual(em_extractor.get_nlu_response(), self.full)
+        analyze.assert_called_once_with(self.text)
+
+    def test_whole_text_is_analysed_when_a_part_failed(self):
+        em_extractor = self.extractor([
+            (40, resolved([{'class_name': 'excited', 'confidence': 0.2}])),
+            (60, resolved(exception=ApiException(500, message="Internal Server Error"))),
+        ])
+        with mock.patch.object(em_extractor, '_analyze', return_value=self.full) as analyze:
+            self.assertEqual(em_extractor.get_nlu_response(), self.full)
+        analyze.assert_called_once_with(self.text)
+
+if __name__ == '__main__':
+    unittest.main()
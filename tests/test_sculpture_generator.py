@@ -0,0 +1,106 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import cadquery as cq
+from OCP.Standard import Standard_ProgramError, Standard_ConstructionError, Standard_OutOfMemory
+from OCP.OSD import OSD_SIGINT, OSD_SIGSEGV
+
+import SculptureGenerator
+from SculptureGenerator import SculptureGenerator as Generator
+
+response = [
+    {'class_name': 'excited', 'confidence': 0.4},
+    {'class_name': 'sad', 'confidence': 0.3},
+    {'class_name': 'frustrated', 'confidence': 0.2},
+    {'class_name': 'satisfied', 'confidence': 0.1},
+]
+
+class GeometryErrorsTest(unittest.TestCase):
+
+    def test_flat_occt_exceptions_are_geometry_errors(self):
+        for exception in (Standard_ProgramError, Standard_ConstructionError):
+            self.assertTrue(issubclass(exception, SculptureGenerator.GEOMETRY_ERRORS))
+
+    def test_faults_and_interrupts_are_not_geometry_errors(self):
+        for exception in (OSD_SIGINT, OSD_SIGSEGV, Standard_OutOfMemory):
+            self.assertFalse(issubclass(exception, SculptureGenerator.GEOMETRY_ERRORS))
+
+    def test_layer_is_retried_after_occt_exception(self):
+        gen = Generator()
+        layers = []
+
+        def gen_layer(res, layer, i, *args):
+            layers.append(i)
+            if layers.count(i) == 1:
+                raise Standard_ProgramError("TopOpeBRepDS_DataStructure::Point")
+            return res
+
+        bot = cq.Workplane("XY").box(1, 1, 1)
+        with mock.patch.object(gen, 'gen_type1', side_effect=gen_layer), \
+                mock.patch.object(gen, 'gen_type2', side_effect=gen_layer):
+            self.assertIs(gen.shape_top(bot, response), bot)
+
+        # Every layer fails once and succeeds on its second attempt
+        self.assertEqual(layers, [i for i in range(len(layers)//2) for _ in range(2)])
+
+    def test_top_is_regenerated_after_occt_exception(self):
+        gen = Generator()
+        bot = cq.Workplane("XY").box(1, 1, 1)
+        top = cq.Workplane("XY").box(2, 2, 2)
+
+        with mock.patch.object(gen, 'gen_waveform_base', return_value=bot), \
+                mock.patch.object(gen, 'shape_top', side_effect=[Standard_ConstructionError("ChFi3d_Builder:only 2 faces"), top]) as shape_top:
+            self.assertIs(gen.generate(response, [0.0]*SculptureGenerator.p_num), top)
+
+        self.assertEqual(shape_top.call_count, 2)
+
+    def test_random_base_is_used_after_occt_exception(self):
+        gen = Generator()
+        bot = cq.Workplane("XY").box(1, 1, 1)
+
+        def gen_waveform_base(p_num, r, h, audio_array, rand_base=False, skip_p=None):
+            if not rand_base:
+                raise Standard_ConstructionError("ChFi3d_Builder:only 2 faces")
+            return bot
+
+        with mock.patch.object(gen, 'gen_waveform_base', side_effect=gen_waveform_base) as waveform_base, \
+                mock.patch.object(gen, 'shape_top', side_effect=lambda bot, response: bot):
+            self.assertIs(gen.generate(response, [0.0]*SculptureGenerator.p_num), bot)
+
+        # Every waveform configuration is tried once before the random base
+        self.assertEqual([call.kwargs for call in waveform_base.call_args_list],
+                         [{'skip_p': None}, {'skip_p': 1}, {'skip_p': 2}, {'rand_base': True}])
+
+    def test_random_base_is_used_for_nan_audio(self):
+        gen = Generator()
+        bot = cq.Workplane("XY").box(1, 1, 1)
+
+        with mock.patch.object(gen, 'gen_waveform_base', return_value=bot) as waveform_base, \
+                mock.patch.object(gen, 'shape_top', side_effect=lambda bot, response: bot):
+            gen.generate(response, np.full(SculptureGenerator.p_num, np.nan))
+
+        self.assertEqual([call.kwargs for call in waveform_base.call_args_list], [{'rand_base': True}])
+
+class SpikyLayerTest(unittest.TestCase):
+
+    def test_spike_sketch_is_centred_at_origin(self):
+        face = SculptureGenerator.spike_sketch(6, 5.0)._faces
+        center = face.Center()
+        self.assertAlmostEqual(center.x, 0.0, places=6)
+        self.assertAlmostEqual(center.y, 0.0, places=6)
+
+    def test_frustrated_response_builds_spiky_layer(self):
+        gen = Generator()
+        gen.rng.seed(0)
+        gen.np_rng = np.random.default_rng(0)
+        frustrated = [{'class_name': 'frustrated', 'confidence': 1.0}]
+
+        with mock.patch.object(SculptureGenerator, 'spike_sketch', wraps=SculptureGenerator.spike_sketch) as spike_sketch:
+            result = gen.generate(frustrated, np.zeros(SculptureGenerator.p_num))
+
+        self.assertTrue(spike_sketch.called)
+        self.assertTrue(result.val().isValid())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import io
+import wave
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import WaveProcessor
+
+def wav_bytes(samples, channels=1, frame_rate=8000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(frame_rate)
+        wav.writeframes(np.asarray(samples, dtype='<i2').tobytes())
+    return buffer.getvalue()
+
+class Upload:
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.stream = io.BytesIO(data)
+
+class DecodeTest(unittest.TestCase):
+
+    def decode(self, stream):
+        ffmpeg = mock.Mock(returncode=0)
+        ffmpeg.communicate.return_value = (wav_bytes(np.arange(100)), b'')
+        with mock.patch.object(WaveProcessor.subprocess, 'Popen', return_value=ffmpeg) as popen:
+            audio = WaveProcessor.decode(stream)
+        self.assertEqual(len(audio.raw_data), 200)
+        return popen.call_args.kwargs['stdin'], ffmpeg.communicate.call_args.kwargs['input']
+
+    def test_in_memory_upload_is_piped_without_rolling_over(self):
+        stream = tempfile.SpooledTemporaryFile(max_size=1024*500, mode='rb+')
+        stream.write(b'encoded audio')
+        self.addCleanup(stream.close)
+
+        stdin, audio_data = self.decode(stream)
+
+        self.assertIs(stdin, subprocess.PIPE)
+        self.assertEqual(audio_data, b'encoded audio')
+        self.assertFalse(stream._rolled)
+
+    def test_file_backed_upload_is_read_by_ffmpeg(self):
+        stream = tempfile.TemporaryFile('rb+')
+        stream.write(b'encoded audio')
+        self.addCleanup(stream.close)
+
+        stdin, audio_data = self.decode(stream)
+
+        self.assertIs(stdin, stream)
+        self.assertIsNone(audio_data)
+
+class ProcessTest(unittest.TestCase):
+
+    def test_recording_shorter_than_the_bins_is_nan(self):
+        w_proc = WaveProcessor.WaveProcessor(Upload('recording.wav', wav_bytes(np.arange(WaveProcessor.p_num - 1))))
+
+        p_audio_array = w_proc.process()
+
+        self.assertEqual(p_audio_array.shape, (WaveProcessor.p_num,))
+        self.assertTrue(np.isnan(p_audio_array).all())
+
+    def test_recording_shorter_than_the_bins_is_nan_in_stride_mode(self):
+        w_proc = WaveProcessor.WaveProcessor(Upload('recording.wav', wav_bytes(np.arange(WaveProcessor.p_num - 1))))
+
+        p_audio_array = w_proc.process(mode='stride')
+
+        self.assertEqual(p_audio_array.shape, (WaveProcessor.p_num,))
+        self.assertTrue(np.isnan(p_audio_array).all())
+
+    def test_constant_recording_maps_to_the_upper_bound(self):
+        w_proc = WaveProcessor.WaveProcessor(Upload('recording.wav', wav_bytes(np.full(1000, 7))))
+
+        np.testing.assert_array_equal(w_proc.process(), np.full(WaveProcessor.p_num, 0.04))
+
+class SaveToMp3Test(unittest.TestCase):
+
+    def test_file_with_the_upload_name_is_loaded_from_disk(self):
+        w_proc = WaveProcessor.WaveProcessor(Upload('recording.wav', wav_bytes(np.arange(100))))
+        local = mock.Mock()
+
+        with mock.patch.object(WaveProcessor.AudioSegment, 'from_file', return_value=local) as from_file, \
+                mock.patch.object(WaveProcessor.AudioSegment, 'export') as export:
+            w_proc.save_to_mp3('recording.wav')
+
+        from_file.assert_called_once_with('recording.wav', format='wav')
+        local.export.assert_called_once()
+        export.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()